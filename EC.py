@@ -1,29 +1,78 @@
 import os
+import json
+import time
+import hashlib
+import threading
+import shutil
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, Future
+import numpy as np
 import pandas as pd
+import faiss
 from openpyxl import load_workbook
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+from openpyxl.packaging.relationship import get_rels_path, get_dependents
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.reader.drawings import find_images
 from PIL import Image as PILImage
 import io
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.schema import Document
 from config import source_path
-from utils import load_from_dataset
+from embedding_cache import load_embeddings, LRUCache
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from side_store import IdDocstore, PositionIds, has_side_store, IDS_FILE, FIELDS_FILE, META_FILE
+from vector_index import build_index, search_params, recall_report, remove_vectors, append_vectors, exact_rerank, REPORT_CONFIGS
+from records import SearchHit, SearchResults
+from utils import load_from_dataset, load_record_store, clear_record_store, dataset_store_path, read_dataset_frame, write_dataset_frame, export_dataset_csv
+
+# 无需转换即可直接保存的图片格式及其扩展名
+IMAGE_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'gif': 'gif'}
+
+# 向量库目录中的指针文件，内容为当前版本子目录的名称；保存时写入新版本后一次替换指针完成切换
+CURRENT_FILE = "CURRENT"
+# 旧版布局直接保存在向量库目录下的文件，切换到版本子目录后删除
+LEGACY_FILES = ["index.faiss", "index.pkl", "bm25.json", IDS_FILE, FIELDS_FILE, META_FILE]
+
+# Engine 的检索状态：各部分一起生成、一次赋值整体替换，检索时只读取一次 engine.state，
+# 热重载或增量更新过程中不会读到新向量库配旧编号这类新旧混合的状态；
+# generation 每次替换时递增，用作检索结果缓存键的一部分
+EngineState = namedtuple('EngineState', ['vectorstore', 'dataset', 'partitions', 'lexical', 'id_map', 'fields', 'owners', 'generation'])
 
 
 class DataSet:
-    def __init__(self, folder, output_excel="Dataset.csv", output_images_dir="images"):
+    def __init__(self, folder, output_excel="Dataset.csv", output_images_dir="images", manifest_path=None, workers=None, export_csv=False):
         self.folder = folder
         self.output_excel = output_excel
         self.output_images_dir = output_images_dir
-        if os.path.exists(output_excel):
-            self.dataset = load_from_dataset(input_excel=output_excel, images_dir=output_images_dir)
+        # 数据集以 Parquet 格式保存在 output_excel 同名的 .parquet 文件中，CSV 仅作为可选导出
+        self.export_csv = export_csv
+        # 并行解析的进程数，1 表示在当前进程中逐个解析
+        self.workers = workers or source_path['ingest']['workers'] or os.cpu_count() or 1
+        self.errors = {}
+        # 清单文件记录每个 EQ 工作簿的路径、修改时间、大小和内容哈希，用于增量更新
+        self.manifest_path = manifest_path or os.path.join(os.path.dirname(str(output_excel)), "manifest.json")
+        if os.path.exists(dataset_store_path(output_excel)) or os.path.exists(output_excel):
+            self.dataset = load_record_store(input_excel=output_excel, images_dir=output_images_dir)
         else:
             self.dataset = self.main(folder)
 
-    def identify_template(self, sheet):
+    def __getstate__(self):
+        """进程池传递实例时不复制已加载的数据集"""
+        state = self.__dict__.copy()
+        state.pop('dataset', None)
+        return state
+
+    def cell_value(self, rows, ref):
+        """按 'C1' 形式的坐标从整表行数据中取值"""
+        column, row = coordinate_from_string(ref)
+        col = column_index_from_string(column)
+        if row > len(rows) or col > len(rows[row - 1]):
+            return None
+        return rows[row - 1][col - 1]
+
+    def identify_template(self, rows):
         """识别模板类型"""
-        a1_value = sheet['A1'].value
+        a1_value = self.cell_value(rows, 'A1')
         if a1_value and 'STG Customer' in str(a1_value):
             return 'STG'
         elif a1_value and ('CML Customer' in str(a1_value) or "CML Customer's Name" in str(a1_value) or "Customer's Name" in str(a1_value)):
@@ -31,115 +80,150 @@ class DataSet:
         else:
             return 'Unknown'
 
-    def read_stg_template(self, sheet):
+    def read_stg_template(self, rows):
         """读取STG模板的指定内容"""
         base_info = {
-            'Customer Name': sheet['C1'].value,
-            'Customer P/N': sheet['C2'].value,
-            'Factory P/N': sheet['E2'].value,
-            'Date': sheet['E3'].value,
-            'Base Material': sheet['C7'].value,
-            'Solder Mask': sheet['E7'].value,
-            'Via Plugging Type': sheet['C10'].value,
-            'STG P/N': sheet['C3'].value,
-            'Engineer': sheet['E1'].value,
-            "Panel Size": sheet['E8'].value,
+            'Customer Name': self.cell_value(rows, 'C1'),
+            'Customer P/N': self.cell_value(rows, 'C2'),
+            'Factory P/N': self.cell_value(rows, 'E2'),
+            'Date': self.cell_value(rows, 'E3'),
+            'Base Material': self.cell_value(rows, 'C7'),
+            'Solder Mask': self.cell_value(rows, 'E7'),
+            'Via Plugging Type': self.cell_value(rows, 'C10'),
+            'STG P/N': self.cell_value(rows, 'C3'),
+            'Engineer': self.cell_value(rows, 'E1'),
+            "Panel Size": self.cell_value(rows, 'E8'),
         }
         
         issues = []
-        row = 13
-        while sheet[f'A{row}'].value:
-            if sheet[f'B{row}'].value is None:
-                row += 1
+        # 问题从第 13 行开始，A-F 列依次为编号、描述、工厂建议、STG 提案、客户决定、状态
+        for no, description, suggestion, proposal, decision, status in (values[:6] for values in rows[12:]):
+            if not no:
+                break
+            if description is None:
                 continue
             issue = {
-                'No': sheet[f'A{row}'].value,
-                'Description': {'text': sheet[f'B{row}'].value, 'image': []},
-                'Factory Suggestion': {'text': sheet[f'C{row}'].value, 'image': []},
-                'STG Proposal': {'text': sheet[f'D{row}'].value, 'image': []},
-                'Customer Decision': {'text': sheet[f'E{row}'].value, 'image': []},
-                'EQ Status': sheet[f'F{row}'].value
+                'No': no,
+                'Description': {'text': description, 'image': []},
+                'Factory Suggestion': {'text': suggestion, 'image': []},
+                'STG Proposal': {'text': proposal, 'image': []},
+                'Customer Decision': {'text': decision, 'image': []},
+                'EQ Status': status
             }
             issue.update(base_info)
             issues.append(issue)
-            row += 1
         return issues
 
-    def read_cml_template(self, sheet):
+    def read_cml_template(self, rows):
         """读取CML模板的指定内容"""
         base_info = {
-            'Customer Name': sheet['C1'].value,
-            'Customer P/N': sheet['C2'].value,
-            'Factory P/N': sheet['E2'].value,
-            'Date': sheet['E3'].value,
-            'Base Material': sheet['C7'].value,
-            'Solder Mask': sheet['E7'].value,
+            'Customer Name': self.cell_value(rows, 'C1'),
+            'Customer P/N': self.cell_value(rows, 'C2'),
+            'Factory P/N': self.cell_value(rows, 'E2'),
+            'Date': self.cell_value(rows, 'E3'),
+            'Base Material': self.cell_value(rows, 'C7'),
+            'Solder Mask': self.cell_value(rows, 'E7'),
             'Via Plugging Type': None,
-            "STG P/N": sheet['C3'].value,
-            "Engineer": sheet['E1'].value,
+            "STG P/N": self.cell_value(rows, 'C3'),
+            "Engineer": self.cell_value(rows, 'E1'),
             'Panel Size': None
         }
         
         issues = []
-        row = 10
-        while sheet[f'A{row}'].value:
-            if sheet[f'B{row}'].value is None:
-                row += 1
+        # 问题从第 10 行开始，A-E 列依次为编号、描述、工厂建议、客户决定、状态
+        for no, description, suggestion, decision, status in (values[:5] for values in rows[9:]):
+            if not no:
+                break
+            if description is None:
                 continue
             issue = {
-                'No': sheet[f'A{row}'].value,
-                'Description': {'text': sheet[f'B{row}'].value, 'image': []},
-                'Factory Suggestion': {'text': sheet[f'C{row}'].value, 'image': []},
+                'No': no,
+                'Description': {'text': description, 'image': []},
+                'Factory Suggestion': {'text': suggestion, 'image': []},
                 'STG Proposal': {'text': None, 'image': []},
-                'Customer Decision': {'text': sheet[f'D{row}'].value, 'image': []},
-                'EQ Status': sheet[f'E{row}'].value
+                'Customer Decision': {'text': decision, 'image': []},
+                'EQ Status': status
             }
             issue.update(base_info)
             issues.append(issue)
-            row += 1
         return issues
 
-    def extract_images(self, sheet, output_dir, file_name):
-        """提取Excel中的图片并按行存储，保存到本地并记录文件名"""
+    def read_images(self, wb, sheet):
+        """
+        只读模式下的工作表不加载图片，这里直接从 xlsx 压缩包中解析该表的绘图关系，
+        返回带 anchor 的 openpyxl 图片对象
+        """
+        archive = wb._archive
+        rels_path = get_rels_path(sheet._worksheet_path)
+        if rels_path not in archive.namelist():
+            return []
+        images = []
+        for rel in get_dependents(archive, rels_path).find(SpreadsheetDrawing._rel_type):
+            charts, drawing_images = find_images(archive, rel.target)
+            images.extend(drawing_images)
+        return images
+
+    def store_image(self, data, ext, output_dir):
+        """
+        按内容哈希保存图片：文件名为原始字节的 SHA-256 加扩展名，相同图片只保存一次。
+        先写临时文件再原子替换，避免并行解析时多个进程同时写入同一文件。
+        """
+        img_filename = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        output_path = os.path.join(output_dir, img_filename)
+        if not os.path.exists(output_path):
+            tmp_path = f"{output_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, output_path)
+        return img_filename
+
+    def extract_images(self, sheet_images, output_dir, file_name):
+        """提取Excel中的图片并按行存储，保存到内容寻址的图片目录并记录文件名"""
         images = {}
-        idx = 0
-        for img in sheet._images:
-            anchor = img.anchor
-            row = anchor._from.row
-            col = anchor._from.col
+        for idx, img in enumerate(sheet_images):
+            row = img.anchor._from.row
             images[row] = images.get(row, [])
             try:
-                img_data = img._data()
-                pil_img = PILImage.open(io.BytesIO(img_data))
-                img_filename = f"{file_name}_image_{idx + 1}.png"
-                output_path = os.path.join(output_dir, img_filename)
-                pil_img.save(output_path)
+                data = img.ref.getvalue()
+                if img.format in IMAGE_EXTENSIONS:
+                    # PNG/JPEG/GIF 直接保存原始字节，不经过 PIL 解码和重新编码
+                    img_filename = self.store_image(data, IMAGE_EXTENSIONS[img.format], output_dir)
+                else:
+                    buffered = io.BytesIO()
+                    PILImage.open(io.BytesIO(data)).save(buffered, format="PNG")
+                    img_filename = self.store_image(buffered.getvalue(), "png", output_dir)
                 images[row].append(img_filename)
-                idx += 1
-            except AttributeError:
-                print(f"无法提取图片 {idx + 1} 的数据")
+            except (AttributeError, OSError):
+                print(f"无法提取 {file_name} 中图片 {idx + 1} 的数据")
         return images
 
     def process_excel(self, file_path, output_dir):
         """主函数：处理Excel文件"""
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        wb = load_workbook(file_path)
-        sheet = wb.active
-        
-        template_type = self.identify_template(sheet)
+        # 并行解析时多个子进程可能同时创建同一图片目录
+        os.makedirs(output_dir, exist_ok=True)
         
-        if template_type == 'STG':
-            issues = self.read_stg_template(sheet)
-        elif template_type == 'CML':
-            issues = self.read_cml_template(sheet)
-        else:
-            print(file_path)
-            raise ValueError("Unknown template type")
-        
-        file_name = os.path.splitext(os.path.basename(file_path))[0]
-        images = self.extract_images(sheet, output_dir, file_name)
+        # 只读模式按行流式解析单元格，不构建完整的工作簿对象模型
+        wb = load_workbook(file_path, read_only=True)
+        try:
+            sheet = wb.active
+            # 部分导出工具写入的表格尺寸不准确，重置后按实际内容读取
+            sheet.reset_dimensions()
+            rows = list(sheet.iter_rows(max_col=6, values_only=True))
+
+            template_type = self.identify_template(rows)
+
+            if template_type == 'STG':
+                issues = self.read_stg_template(rows)
+            elif template_type == 'CML':
+                issues = self.read_cml_template(rows)
+            else:
+                print(file_path)
+                raise ValueError("Unknown template type")
+
+            file_name = os.path.splitext(os.path.basename(file_path))[0]
+            images = self.extract_images(self.read_images(wb, sheet), output_dir, file_name)
+        finally:
+            wb.close()
 
         for issue in issues:
             if str(issue['No']).isdigit():
@@ -152,22 +236,22 @@ class DataSet:
 
         return issues, template_type
 
-    def save_to_excel(self, dataset, output_excel):
-        """将数据集保存为 Excel 文件"""
+    def flatten_issues(self, dataset, start=0):
+        """将问题记录展开为 CSV 行，Index 从 start 开始编号"""
         flat_data = []
-        count = 0
+        count = start
         for issue in dataset:
             flat_issue = {
                 "Index": count,
                 'No': issue['No'],
                 'Description': issue['Description']['text'],
-                'Description_Images': ';'.join(issue['Description']['image']),
+                'Description_Images': list(issue['Description']['image']),
                 'Factory Suggestion': issue['Factory Suggestion']['text'],
-                'Factory_Suggestion_Images': ';'.join(issue['Factory Suggestion']['image']),
+                'Factory_Suggestion_Images': list(issue['Factory Suggestion']['image']),
                 'STG Proposal': issue['STG Proposal']['text'],
-                'STG_Proposal_Images': ';'.join(issue['STG Proposal']['image']),
+                'STG_Proposal_Images': list(issue['STG Proposal']['image']),
                 'Customer Decision': issue['Customer Decision']['text'],
-                'Customer_Decision_Images': ';'.join(issue['Customer Decision']['image']),
+                'Customer_Decision_Images': list(issue['Customer Decision']['image']),
                 'EQ Status': 'Closed',
                 'Customer Name': issue['Customer Name'],
                 'Customer P/N': issue['Customer P/N'],
@@ -185,88 +269,751 @@ class DataSet:
             }
             flat_data.append(flat_issue)
             count += 1
-        
-        df = pd.DataFrame(flat_data)
-        df.to_csv(output_excel, index=False)
-        print(f"数据集已保存到 {output_excel}")
+        return flat_data
+
+    def save_to_excel(self, dataset, output_excel):
+        """将数据集导出为 CSV 文件"""
+        export_dataset_csv(pd.DataFrame(self.flatten_issues(dataset)), output_excel)
+        print(f"数据集已导出到 {output_excel}")
+
+    def save_dataset(self, df):
+        """将展开后的数据集保存为 Parquet，按需同时导出 CSV"""
+        write_dataset_frame(df, self.output_excel)
+        print(f"数据集已保存到 {dataset_store_path(self.output_excel)}")
+        if self.export_csv:
+            export_dataset_csv(df, self.output_excel)
+            print(f"数据集已导出到 {self.output_excel}")
+
+    def file_signature(self, file_path):
+        """计算工作簿的清单条目：路径、修改时间、大小和 SHA-256 内容哈希"""
+        stat = os.stat(file_path)
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return {
+            'path': str(file_path),
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha256': digest.hexdigest(),
+        }
+
+    def read_manifest(self):
+        """读取清单文件的全部内容，不存在或损坏时返回空字典"""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"清单文件 {self.manifest_path} 无法读取，将执行完整重建")
+            return {}
+
+    def load_manifest(self):
+        """读取清单中的文件条目，不存在或损坏时返回空清单"""
+        return self.read_manifest().get('files', {})
+
+    def next_index(self):
+        """
+        下一个可用的 Index：清单中记录的最高编号与现有数据集最大 Index 之后的较大者。
+        Index 只增不减，已退役的编号不会再分配给其他问题，Engine 按 Index 同步时不会把旧向量当成新问题的向量
+        """
+        start = int(self.read_manifest().get('next_index', 0))
+        if os.path.exists(dataset_store_path(self.output_excel)) or os.path.exists(self.output_excel):
+            df = read_dataset_frame(self.output_excel)
+            if not df.empty:
+                start = max(start, int(df['Index'].max()) + 1)
+        return start
+
+    def save_manifest(self, manifest, next_index):
+        """原子写入清单文件，同时记录下一个可用的 Index"""
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'version': 1, 'next_index': next_index, 'files': manifest}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def scan_folder(self, folder, manifest):
+        """
+        对比清单与目录，返回 (新增或修改的文件, 已删除的文件, 新清单)。
+        修改时间和大小都未变的文件直接跳过；否则再比较内容哈希，哈希不同才需要重新解析。
+        上次解析失败（清单中标记 failed）的文件总是重新解析，临时性的失败（如文件仍在复制）在下次更新时自动恢复。
+        """
+        files = sorted(i for i in list(os.walk(folder))[0][2] if i.endswith('.xlsx'))
+        changed = []
+        new_manifest = {}
+        for i in files:
+            file_path = os.path.join(folder, i)
+            stat = os.stat(file_path)
+            entry = manifest.get(i)
+            failed = bool(entry and entry.get('failed'))
+            if entry and not failed and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                new_manifest[i] = entry
+                continue
+            signature = self.file_signature(file_path)
+            new_manifest[i] = signature
+            if not entry or failed or entry['sha256'] != signature['sha256']:
+                changed.append(i)
+        removed = sorted(set(manifest) - set(files))
+        return changed, removed, new_manifest
+
+    def parse_workbook(self, file_path):
+        """解析单个工作簿，返回 (问题记录, 错误信息)；在进程池的子进程中执行"""
+        try:
+            issues, template = self.process_excel(file_path, self.output_images_dir)
+            return issues, None
+        except Exception as e:
+            return [], f"{type(e).__name__}: {e}"
+
+    def parse_files(self, folder, files):
+        """
+        解析多个工作簿，workers > 1 时分发到进程池。
+        结果按 files 的顺序合并，保证 Index 编号稳定；解析错误按文件名记录在 self.errors 中。
+        """
+        paths = [os.path.join(folder, i) for i in files]
+        os.makedirs(self.output_images_dir, exist_ok=True)
+        if self.workers > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(paths))) as executor:
+                results = list(executor.map(self.parse_workbook, paths))
+        else:
+            results = [self.parse_workbook(path) for path in paths]
+
+        dataset = []
+        errors = {}
+        for i, (issues, error) in zip(files, results):
+            if error:
+                errors[i] = error
+                print(f"无法解析 {i}：{error}")
+            else:
+                dataset.extend(issues)
+        return dataset, errors
+
+    def existing_rows(self, files):
+        """现有数据集中来自指定工作簿的行，数据集不存在时返回 None"""
+        if not (os.path.exists(dataset_store_path(self.output_excel)) or os.path.exists(self.output_excel)):
+            return None
+        df = read_dataset_frame(self.output_excel)
+        return df[df['FileName'].isin(set(files))]
 
     def main(self, folder):
         """生成数据集并保存为 Excel"""
         global missed
-        dataset = []
-        files = list(os.walk(folder))[0][2]
+        files = sorted(list(os.walk(folder))[0][2])
+        workbooks = [i for i in files if i.endswith('.xlsx')]
+        dataset, self.errors = self.parse_files(folder, workbooks)
+        missed = [i for i in files if not i.endswith('.xlsx')] + list(self.errors)
+
+        manifest = {}
+        for i in workbooks:
+            manifest[i] = self.file_signature(os.path.join(folder, i))
+            # 解析失败的文件也记入清单并标记 failed，下次更新时重新解析
+            if i in self.errors:
+                manifest[i]['failed'] = True
+
+        # 解析失败的文件保留现有数据集中的行（包括 Index），不因一次临时失败丢失问题记录
+        kept = self.existing_rows(self.errors) if self.errors else None
+        if not dataset and (kept is None or kept.empty):
+            return dataset
+        # 完整重建也接着已用过的最高编号继续，不复用旧 Index
+        start = self.next_index()
+        df = pd.DataFrame(self.flatten_issues(dataset, start=start))
+        if kept is not None and not kept.empty:
+            df = pd.concat([kept, df.reindex(columns=kept.columns)], ignore_index=True)
+        self.save_dataset(df)
+        self.save_manifest(manifest, start + len(dataset))
+        return self.reload()
+
+    def incremental_update(self, folder):
+        """增量更新：只解析新增或修改的工作簿，移除已删除或已修改文件的旧问题记录"""
+        global missed
+        manifest = self.load_manifest()
+        if not manifest or not (os.path.exists(dataset_store_path(self.output_excel)) or os.path.exists(self.output_excel)):
+            return self.main(folder)
+
+        changed, removed, new_manifest = self.scan_folder(folder, manifest)
         missed = []
-        for i in files:
-            try:
-                if i.endswith('.xlsx'):
-                    issues, template = self.process_excel(os.path.join(folder, i), self.output_images_dir)
-                    dataset.extend(issues)
-                else:
-                    missed.append(i)
-            except:
-                missed.append(i)
-            
-        if dataset:
-            self.save_to_excel(dataset, self.output_excel)
-        return dataset
-        
-    def update(self, folder):
-        """更新数据集"""
-        self.dataset = self.main(folder)
+        self.errors = {}
+        if not changed and not removed:
+            if new_manifest != manifest:
+                self.save_manifest(new_manifest, self.next_index())
+            print("数据集无变化")
+            return self.dataset
+
+        new_issues, self.errors = self.parse_files(folder, changed)
+        missed = list(self.errors)
+        for i in self.errors:
+            new_manifest[i]['failed'] = True
+
+        # 未变化文件和解析失败文件的行（包括 Index）保持原样，新行的 Index 接在历史最高编号之后
+        df = read_dataset_frame(self.output_excel)
+        kept = df[~df['FileName'].isin((set(changed) - set(self.errors)) | set(removed))]
+        start = self.next_index()
+        added = pd.DataFrame(self.flatten_issues(new_issues, start=start), columns=df.columns)
+        merged = pd.concat([kept, added], ignore_index=True)
+        self.save_dataset(merged)
+        self.save_manifest(new_manifest, start + len(added))
+        print(f"增量更新完成：解析 {len(changed)} 个文件，新增 {len(added)} 条，移除 {len(df) - len(kept)} 条")
+
+        return self.reload()
+
+    def reload(self):
+        """清除数据集缓存并重新加载，返回与 Engine 共享的只读记录存储"""
+        load_from_dataset.clear()
+        clear_record_store()
+        return load_record_store(input_excel=self.output_excel, images_dir=self.output_images_dir)
+
+    def update(self, folder, incremental=True):
+        """更新数据集，默认只处理有变化的工作簿；incremental=False 时完整重建"""
+        if incremental:
+            self.dataset = self.incremental_update(folder)
+        else:
+            self.dataset = self.main(folder)
         return self.dataset
 
 class Engine:
-    def __init__(self, dataset=None, vectorstore_path="Model", output_excel="Dataset.csv", output_images_dir="images"):
+    def __init__(self, dataset=None, vectorstore_path="Model", output_excel="Dataset.csv", output_images_dir="images", index_config=None, embedding_model=None):
         self.vectorstore_path = vectorstore_path
         self.output_excel = output_excel
         self.output_images_dir = output_images_dir
-        self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+        # 索引类型及 nprobe / efSearch 等参数，见 config.source_path['index']
+        self.index_config = index_config or source_path['index']
+        # 文档嵌入带磁盘缓存，重建索引或比较不同模型时只计算没有缓存过的文本
+        self.embeddings = load_embeddings(embedding_model)
+        # 重复检索的缓存：查询文本 -> 查询向量，(查询, 客户, k) -> 结果编号和分数
+        self.query_cache = LRUCache(source_path['search'].get('query_cache_size', 256))
+        self.result_cache = LRUCache(source_path['search'].get('result_cache_size', 256))
+        self._lock = threading.RLock()
+        self._generations = itertools.count(1)
+        # 以内存映射方式加载的索引（只读），见 load_vectorstore
+        self.mapped_index = None
+        self.mapped_path = None
         
         # 如果本地存在向量模型，直接加载
         if os.path.exists(vectorstore_path):
-            print(f"从 {vectorstore_path} 加载现有向量模型")
-            self.vectorstore = FAISS.load_local(vectorstore_path, self.embeddings, allow_dangerous_deserialization=True)
-            # 加载数据集
-            print(f"从 {output_excel} 加载数据集")
-            self.dataset = load_from_dataset(input_excel=output_excel, images_dir=output_images_dir)
-            
+            self.load()
         else:
             # 如果没有本地模型，必须提供 dataset
             if dataset is None:
                 raise ValueError("未提供数据集且本地不存在向量模型")
             print("构建新的向量模型")
-            self.dataset = dataset
-            self.vectorstore = self.build_vectorstore(dataset)
-            self.vectorstore.save_local(vectorstore_path)
-            print(f"向量模型已保存到 {vectorstore_path}")
+            self.set_state(self.build_vectorstore(dataset), dataset, self.build_lexical(dataset))
+            self.save()
+
+    def current_path(self):
+        """
+        当前版本的向量库目录：CURRENT 指针文件指向的版本子目录；
+        没有指针文件时为旧版布局，即 vectorstore_path 本身
+        """
+        root = str(self.vectorstore_path)
+        try:
+            with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+                version = f.read().strip()
+        except OSError:
+            return root
+        return os.path.join(root, version) if version else root
+
+    def disk_signature(self):
+        """当前版本的向量索引文件和数据集文件的 (路径, 修改时间, 大小)，用于判断磁盘上的内容是否已更新"""
+        current = self.current_path()
+        paths = [
+            os.path.join(current, "index.faiss"),
+            os.path.join(current, IDS_FILE),
+            dataset_store_path(self.output_excel),
+            str(self.output_excel),
+        ]
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def load(self):
+        """从磁盘加载向量模型和共享数据集，复用已加载的嵌入模型"""
+        with self._lock:
+            signature = self.disk_signature()
+            # 加载数据集
+            print(f"从 {self.output_excel} 加载数据集")
+            dataset = load_record_store(input_excel=self.output_excel, images_dir=self.output_images_dir)
+            path = self.current_path()
+            if not has_side_store(path):
+                # 旧版向量库的 docstore 需要 pickle 反序列化，不再读取；由数据集重新构建（嵌入有磁盘缓存）
+                print(f"{self.vectorstore_path} 是旧版格式，重新构建向量模型")
+                self.set_state(self.build_vectorstore(dataset), dataset, self.build_lexical(dataset))
+                self.save()
+                return
+            print(f"从 {path} 加载现有向量模型")
+            vectorstore = self.load_vectorstore(path)
+            # 旧版向量库没有词法索引时由数据集重新构建，下次保存时写入
+            lexical = BM25Index.load(self.lexical_path(path)) or self.build_lexical(dataset)
+            self.set_state(vectorstore, dataset, lexical)
+            self.signature = signature
+
+    def load_vectorstore(self, path):
+        """
+        加载索引文件和只含编号的侧文件，不涉及 pickle 反序列化。
+        mmap 开启时用 IO_FLAG_MMAP_IFC（faiss >= 1.11）零拷贝映射索引文件：flat / sq8 / sq_fp16 的编码、
+        HNSW 的向量和 IVF 的倒排表都直接引用页缓存，多个进程加载同一目录时共享内存，启动时间与索引大小基本无关
+        （HNSW 的图结构仍读入内存）。映射的索引是只读的，修改前需由 writable_index 重新读取。
+        没有 IO_FLAG_MMAP_IFC 的旧版 faiss 只能映射 IVF 的倒排表，其他索引仍整体读入内存。
+        """
+        mmap = self.index_config.get('mmap', True)
+        flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(os.path.join(str(path), "index.faiss"), flags)
+        # 记录映射加载的索引及其所在目录，增量更新时据此判断是否需要可写副本
+        self.mapped_index = index if mmap else None
+        self.mapped_path = str(path)
+        docstore = IdDocstore.load(str(path), mmap=mmap)
+        return self.wrap(index, docstore)
+
+    def writable_index(self, index):
+        """
+        返回可以复制和修改的索引：内存映射加载的索引引用的是只读文件页，复制后修改会失败，
+        因此从加载它的版本目录重新完整读取一份（保存时只清理更早的版本，该目录仍然存在）；其他索引原样返回
+        """
+        if index is not None and index is self.mapped_index:
+            return faiss.read_index(os.path.join(self.mapped_path, "index.faiss"))
+        return index
+
+    def wrap(self, index, docstore):
+        """由索引和 docstore 组装 FAISS 向量库，第 i 个向量的 docstore 编号即 str(i)"""
+        # LangChain 只在构建向量库时才导入，EC 模块本身保持轻量
+        from langchain_community.vectorstores import FAISS
+        return FAISS(self.embeddings, index, docstore, PositionIds(len(docstore)), **docstore.settings)
+
+    def set_state(self, vectorstore, dataset, lexical):
+        """
+        整体替换向量库、数据集、词法索引及其派生的客户分组和 Index 映射。
+        所有修改都生成新对象，最后以一次赋值替换 self.state，正在进行的检索继续使用旧状态。
+        """
+        if vectorstore.docstore.records is not dataset:
+            # 文本和记录都从当前的记录表中取；换记录表时生成新的 docstore，不修改旧状态仍在使用的对象
+            vectorstore = self.wrap(vectorstore.index, vectorstore.docstore.with_records(dataset))
+        id_map, fields, owners = self.build_layout(vectorstore)
+        partitions = self.build_partitions(vectorstore, dataset, owners)
+        self.state = EngineState(vectorstore, dataset, partitions, lexical, id_map, fields, owners, next(self._generations))
+        # 旧状态的检索结果不会再命中（键中的 generation 不同），清空以释放内存；查询向量只取决于嵌入模型，继续保留
+        self.result_cache.clear()
+
+    # 只读访问当前状态的各部分；同一次检索需要多个部分时请只读取一次 self.state
+    vectorstore = property(lambda self: self.state.vectorstore)
+    dataset = property(lambda self: self.state.dataset)
+    partitions = property(lambda self: self.state.partitions)
+    lexical = property(lambda self: self.state.lexical)
+    id_map = property(lambda self: self.state.id_map)
+    fields = property(lambda self: self.state.fields)
+    owners = property(lambda self: self.state.owners)
+
+    def save(self):
+        """
+        原子保存向量库：先写入新的版本子目录，再以一次 os.replace 替换 CURRENT 指针文件完成切换，
+        任何时刻读取方都能通过指针读到一个完整的版本。
+        切换后只保留当前、上一个和本进程映射加载的版本，其他进程可能仍在读取或映射上一个版本的文件
+        """
+        with self._lock:
+            state = self.state
+            root = str(self.vectorstore_path)
+            os.makedirs(root, exist_ok=True)
+            previous = self.current_path()
+            version = f"v{time.time_ns()}_{os.getpid()}"
+            tmp_path = os.path.join(root, f".{version}.tmp")
+            os.makedirs(tmp_path)
+            # 索引只保存向量，侧文件只保存每个向量对应的问题 Index 和字段，不使用 pickle
+            faiss.write_index(state.vectorstore.index, os.path.join(tmp_path, "index.faiss"))
+            state.vectorstore.docstore.save(tmp_path)
+            state.lexical.save(self.lexical_path(tmp_path))
+            os.replace(tmp_path, os.path.join(root, version))
+            pointer = os.path.join(root, CURRENT_FILE)
+            with open(f"{pointer}.{version}.tmp", "w", encoding="utf-8") as f:
+                f.write(version)
+            os.replace(f"{pointer}.{version}.tmp", pointer)
+            self.remove_old_versions(root, keep={os.path.join(root, version), previous, self.mapped_path})
+            self.signature = self.disk_signature()
+            print(f"向量模型已保存到 {os.path.join(root, version)}")
+
+    def remove_old_versions(self, root, keep):
+        """
+        删除 keep 以外的版本子目录；上一个版本是旧版布局（root 本身）时保留其文件，下次保存时再删除。
+        仍被占用（如 Windows 上被映射）的文件删除失败时忽略，下次保存时再删除
+        """
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.startswith("v") and path not in keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif name in LEGACY_FILES and root not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def lexical_path(self, vectorstore_path):
+        """词法索引与 FAISS 文件保存在同一版本目录，随向量库一起切换"""
+        return os.path.join(str(vectorstore_path), "bm25.json")
+
+    def build_lexical(self, issues):
+        """由问题记录构建 BM25 词法索引，字段见 source_path['hybrid']['fields']"""
+        config = source_path['hybrid']
+        return BM25Index.from_issues(issues, config['fields'], config.get('k1', 1.5), config.get('b', 0.75))
+
+    def reload_if_changed(self):
+        """
+        热重载：磁盘上的索引变化时重新加载；数据集变化时把新增的问题加入索引、移除已删除的问题。
+        返回是否有更新。
+        """
+        if self.disk_signature() == self.signature:
+            return False
+        with self._lock:
+            signature = self.disk_signature()
+            if signature == self.signature:
+                return False
+            clear_record_store()
+            try:
+                if signature[:2] != self.signature[:2]:
+                    self.load()
+                else:
+                    self.signature = signature
+                self.sync_with_dataset()
+            except Exception as e:
+                # 其他进程正在替换目录等情况下保留旧状态，下次调用时重试
+                print(f"重新加载向量模型失败：{e}")
+                return False
+            return True
+
+    def field_texts(self, issue):
+        """问题中需要建立向量的 (字段, 文本)，字段见 index_config['fields']，空文本跳过"""
+        texts = []
+        for field in self.index_config.get('fields', ['Description']):
+            value = issue.get(field)
+            if value and value.get('text'):
+                texts.append((field, value['text']))
+        return texts
+
+    def build_documents(self, issues):
+        """
+        由问题记录生成每个问题每个文本字段的 (问题 Index, 字段) 和对应文本。
+        向量库只保存编号，完整记录在检索时从共享的记录表中取出，避免向量库再保存一份副本
+        """
+        owners, texts = [], []
+        for issue in issues:
+            for field, text in self.field_texts(issue):
+                owners.append((issue['Index'], field))
+                texts.append(text)
+        return owners, texts
 
     def build_vectorstore(self, dataset):
-        """从数据集中构建 FAISS 向量存储"""
+        """从数据集中构建 FAISS 向量存储，与原 LangChain 构建方式一致使用 L2 距离、不做归一化"""
         if not dataset:
             raise ValueError("数据集为空")
-        texts = [issue['Description']['text'] for issue in dataset]
-        documents = [Document(page_content=text, metadata=issue) for text, issue in zip(texts, dataset)]
-        vectorstore = FAISS.from_documents(documents, self.embeddings, distance_strategy="COSINE")
-        return vectorstore
+        owners, texts = self.build_documents(dataset)
+        vectors = self.embeddings.embed_array(texts)
+        index = build_index(vectors, self.index_config, faiss.METRIC_L2)
+        docstore = IdDocstore.from_owners(owners, {'normalize_L2': False, 'distance_strategy': 'COSINE'}, dataset)
+        return self.wrap(index, docstore)
+
+    def exact_vectors(self):
+        """当前向量库中全部向量的精确值；近似索引无法还原原始向量时由嵌入缓存取出"""
+        vectorstore = self.state.vectorstore
+        index = vectorstore.index
+        if isinstance(index, faiss.IndexFlat):
+            return index.reconstruct_n(0, index.ntotal)
+        return self.exact_lookup(vectorstore)(np.arange(index.ntotal))
+
+    def rebuild_index(self, index_config):
+        """将当前向量库换成指定类型的索引并保存，不需要重新计算嵌入（近似索引除外）"""
+        with self._lock:
+            state = self.state
+            index = build_index(self.exact_vectors(), index_config, state.vectorstore.index.metric_type)
+            self.index_config = index_config
+            self.set_state(self.wrap(index, state.vectorstore.docstore), state.dataset, state.lexical)
+            self.save()
+
+    def recall_report(self, k=10, n_queries=200, configs=REPORT_CONFIGS):
+        """
+        以精确 flat 索引为基准，评估各近似索引配置的 recall@k 与单条查询延迟，
+        查询取自数据集中随机抽样的向量
+        """
+        vectors = self.exact_vectors()
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+        configs = [{**self.index_config, **config} for config in configs]
+        return pd.DataFrame(recall_report(vectors, queries, k=k, configs=configs, metric=self.state.vectorstore.index.metric_type))
+
+    def build_layout(self, vectorstore):
+        """
+        由侧文件中的编号得到：
+        问题 Index 到其全部 FAISS 编号的映射、每个字段的 FAISS 编号数组、每个 FAISS 编号对应的 (Index, 字段)。
+        """
+        owners = vectorstore.docstore.owners()
+        id_map, fields = {}, {}
+        for faiss_id, owner in enumerate(owners):
+            id_map.setdefault(owner[0], []).append(faiss_id)
+            fields.setdefault(owner[1], []).append(faiss_id)
+        return id_map, {field: np.array(ids, dtype=np.int64) for field, ids in fields.items()}, owners
+
+    def replace_issues(self, remove_ids=(), issues=(), save=True):
+        """
+        在现有索引上删除和添加问题，只为新增的问题计算嵌入，不重建整个索引。
+        只修改索引，不修改数据集：检索结果从共享数据集中取记录，同步时也以数据集为准，
+        因此只应由 sync_with_dataset 调用，issues 必须是当前数据集中的记录。
+        :param remove_ids: 要删除的问题 Index
+        :param issues: 要添加的问题记录（需包含 Index 和至少一个建立向量的文本字段）
+        :param save: 是否立即原子保存到向量库目录
+        """
+        with self._lock:
+            state = self.state
+            vectorstore, id_map = state.vectorstore, state.id_map
+            remove = sorted(faiss_id for i in set(remove_ids) for faiss_id in id_map.get(i, ()))
+            if not remove and not issues:
+                return
+            removed = set(remove)
+            keep = [faiss_id for faiss_id in range(vectorstore.index.ntotal) if faiss_id not in removed]
+            index = self.writable_index(vectorstore.index)
+            index = remove_vectors(index, remove) if remove else index
+
+            owners, texts = self.build_documents(issues)
+            if owners:
+                vectors = self.embeddings.embed_array(texts)
+                if vectorstore._normalize_L2:
+                    faiss.normalize_L2(vectors)
+                index = append_vectors(index, vectors)
+            updated = self.wrap(index, vectorstore.docstore.updated(keep, owners))
+            lexical = state.lexical.updated(remove_ids, issues, source_path['hybrid']['fields'])
+            self.set_state(updated, state.dataset, lexical)
+            print(f"向量索引已更新：删除 {len(remove)} 条，新增 {len(issues)} 条")
+            if save:
+                self.save()
+
+    def sync_with_dataset(self, save=True):
+        """
+        与共享数据集对齐：数据集中新增的问题加入索引，已退役的问题从索引中删除。
+        这是增删改问题的唯一入口：先由 DataSet.update 写入数据集，再调用本方法（或等待 reload_if_changed）更新索引。
+        修改过的 EQ 文件在导入时会得到新的 Index，且 Index 只增不减、不会复用（见 DataSet.next_index），
+        因此按 Index 比较即可覆盖新增、删除和修改。
+        """
+        with self._lock:
+            dataset = load_record_store(input_excel=self.output_excel, images_dir=self.output_images_dir)
+            self.set_state(self.state.vectorstore, dataset, self.state.lexical)
+            id_map = self.state.id_map
+            dataset_ids = {issue['Index'] for issue in dataset}
+            added = [issue for issue in dataset if issue['Index'] not in id_map and self.field_texts(issue)]
+            removed = [i for i in id_map if i not in dataset_ids]
+            self.replace_issues(remove_ids=removed, issues=added, save=save)
+
+    def build_partitions(self, vectorstore, dataset, owners):
+        """按客户名称（小写）分组 FAISS 内部编号，检索时作为 ID 选择器预过滤"""
+        partitions = {}
+        for faiss_id, (issue_id, field) in enumerate(owners):
+            # 尚未同步的已退役问题不参与任何客户分组
+            issue = dataset.get_by_id(issue_id)
+            if issue is None:
+                continue
+            customer = str(issue.get('Customer Name', '')).lower()
+            partitions.setdefault(customer, []).append(faiss_id)
+        return {customer: np.array(ids, dtype=np.int64) for customer, ids in partitions.items()}
+
+    def search_similar_descriptions(self, query, customer_name=None, k=20, fields=None, fusion=None):
+        """搜索与查询描述最相似的前 k 个问题记录，参数见 search，返回记录副本列表"""
+        return list(self.search(query, customer_name=customer_name, k=k, fields=fields, fusion=fusion))
+
+    def search(self, query, customer_name=None, k=20, fields=None, fusion=None):
+        """
+        搜索与查询描述最相似的前 k 个问题，可按客户名称过滤。
+        每个问题的各文本字段分别建立向量，同一问题命中的多个字段合并为一条结果：
+        fusion='max' 按最接近的字段排序，fusion='weighted' 按各字段相似度的加权和排序（权重见 source_path['search']['field_weights']）。
+        按客户或字段过滤时通过 ID 选择器只在对应的向量中检索，直接返回前 k 个结果（最相似的在前）。
+        :param fields: 只在这些字段中检索，默认全部已建立向量的字段
+        :return: SearchResults，hits 为不可变的 (问题 Index, 最接近字段的距离)；
+            访问某一条时才取出记录副本，附带 similarity_score、matched_field 和 fused_score
+        """
+        return self.search_in(self.state, query, customer_name, k, fields, fusion)
 
-    def search_similar_descriptions(self, query, customer_name=None, k=20):
-        """搜索与查询描述最相似的前 k 个问题记录，可按客户名称过滤"""
+    def search_in(self, state, query, customer_name=None, k=20, fields=None, fusion=None):
+        """在给定的状态快照中检索，参数见 search"""
+        vectorstore, dataset, partitions, field_ids, owners = state.vectorstore, state.dataset, state.partitions, state.fields, state.owners
+        if not query:
+            return SearchResults((), dataset)
+        fusion = fusion or source_path['search'].get('fusion', 'max')
+        fields = tuple(fields) if fields else tuple(field_ids)
+
+        # 结果缓存键包含状态的 generation，热重载或增量更新后不会命中旧索引的结果，
+        # 替换前开始的检索之后写入的旧结果也只会留在旧 generation 的键下
+        key = (state.generation, query, customer_name.lower() if customer_name else None, k, fields, fusion)
+        hits = self.result_cache.get(key)
+        if hits is None:
+            candidates = self.candidates(partitions, field_ids, customer_name, fields)
+            if candidates is not None and not len(candidates):
+                print(f"未找到客户 '{customer_name}' 的匹配记录")
+                return SearchResults((), dataset)
+            hits = self.search_ids(vectorstore, owners, candidates, [query], k, len(fields), fusion)[0]
+            self.result_cache.put(key, hits)
+        return self.hydrate(dataset, owners, hits)
+
+    def search_many(self, queries, customer_name=None, k=20, fields=None, fusion=None):
+        """
+        批量检索：一次计算全部查询向量，一次矩阵检索，返回与 queries 顺序对应的 SearchResults 列表。
+        参数与 search 相同，结果同样写入检索结果缓存；记录按需取出，
+        可用于一次预取整份 EQ 各问题的相似案例。
+        """
+        # 取同一时刻的快照，热重载时不受影响
+        state = self.state
+        vectorstore, dataset, partitions, field_ids, owners = state.vectorstore, state.dataset, state.partitions, state.fields, state.owners
+        fusion = fusion or source_path['search'].get('fusion', 'max')
+        fields = tuple(fields) if fields else tuple(field_ids)
+        customer = customer_name.lower() if customer_name else None
+
+        keys = [(state.generation, query, customer, k, fields, fusion) for query in queries]
+        hits = [self.result_cache.get(key) if query else () for key, query in zip(keys, queries)]
+        # 同一批中重复的查询只检索一次
+        pending = list(dict.fromkeys(query for query, hit in zip(queries, hits) if hit is None))
+        if pending:
+            candidates = self.candidates(partitions, field_ids, customer_name, fields)
+            if candidates is not None and not len(candidates):
+                print(f"未找到客户 '{customer_name}' 的匹配记录")
+                return [SearchResults((), dataset) for query in queries]
+            found = dict(zip(pending, self.search_ids(vectorstore, owners, candidates, pending, k, len(fields), fusion)))
+            for i, (key, query) in enumerate(zip(keys, queries)):
+                if hits[i] is None:
+                    hits[i] = found[query]
+                    self.result_cache.put(key, hits[i])
+        return [self.hydrate(dataset, owners, hit) for hit in hits]
+
+    def hydrate(self, dataset, owners, hits):
+        """
+        由 (FAISS 编号, 距离, 融合得分) 生成按需取记录的 SearchResults；
+        尚未同步、记录表中已不存在的问题不返回
+        """
+        results, details = [], []
+        for faiss_id, score, fused in hits:
+            issue_id, field = owners[faiss_id]
+            if dataset.position(issue_id) is None:
+                continue
+            results.append(SearchHit(issue_id, score))
+            details.append({'matched_field': field, 'fused_score': fused})
+        return SearchResults(results, dataset, details)
+
+    def hybrid_search(self, query, customer_name=None, k=20, fields=None):
+        """
+        混合检索：向量检索与 BM25 词法检索各取前 depth 个问题，按倒数排名融合后返回前 k 个。
+        料号、材料型号等精确词主要由 BM25 命中，语义相近的描述由向量检索命中。
+        :return: 记录副本，附带 rrf_score、bm25_score，以及向量检索命中时的 similarity_score / matched_field
+        """
         if not query:
             return []
-        
-        docs_and_scores = self.vectorstore.similarity_search_with_score(query, k=len(self.dataset))
-        
+        # 向量检索和词法检索使用同一个状态快照
+        state = self.state
+        dataset, lexical, partitions, owners = state.dataset, state.lexical, state.partitions, state.owners
+        config = source_path['hybrid']
+        depth = max(k, config.get('depth', 50))
+
+        vector_results = self.search_in(state, query, customer_name=customer_name, k=depth, fields=fields)
+        allowed = None
+        if customer_name is not None:
+            # 复用向量检索的客户分组，避免逐条还原记录
+            allowed = {owners[faiss_id][0] for faiss_id in partitions.get(customer_name.lower(), ())}
+        lexical_results = lexical.search(query, depth, allowed)
+
+        # 只对最终返回的结果取出记录
+        by_id = {hit.id: i for i, hit in enumerate(vector_results.hits)}
+        bm25_scores = dict(lexical_results)
+        fused = reciprocal_rank_fusion(
+            [[hit.id for hit in vector_results.hits], [doc_id for doc_id, score in lexical_results]],
+            config.get('rrf_k', 60),
+        )
         results = []
-        for doc, score in docs_and_scores:
-            issue = doc.metadata
-            if customer_name is None or issue['Customer Name'].lower() == customer_name.lower():
-                issue['similarity_score'] = score
-                results.append(issue)
-        
-        results.sort(key=lambda x: x['similarity_score'], reverse=True)
-        if not results and customer_name:
-            print(f"未找到客户 '{customer_name}' 的匹配记录")
-        return results[:k]
+        for issue_id, score in fused[:k]:
+            issue = vector_results[by_id[issue_id]] if issue_id in by_id else dict(dataset.get_by_id(issue_id, {'Index': issue_id}))
+            results.append({**issue, 'rrf_score': score, 'bm25_score': bm25_scores.get(issue_id, 0.0)})
+        return results
+
+    def candidates(self, partitions, field_ids, customer_name, fields):
+        """客户和字段过滤后的候选 FAISS 编号；不需要过滤时返回 None"""
+        candidates = None
+        if customer_name is not None:
+            candidates = partitions.get(customer_name.lower(), np.array([], dtype=np.int64))
+        if set(fields) != set(field_ids):
+            selected = [field_ids[field] for field in fields if field in field_ids]
+            selected = np.sort(np.concatenate(selected)) if selected else np.array([], dtype=np.int64)
+            candidates = selected if candidates is None else np.intersect1d(candidates, selected)
+        return candidates
+
+    def embed_queries(self, queries, normalize):
+        """查询向量矩阵，重复的查询文本直接从缓存中取，其余一次批量计算"""
+        vectors = [self.query_cache.get(query) for query in queries]
+        missing = [query for query, vector in zip(queries, vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_queries(missing)
+            if normalize:
+                faiss.normalize_L2(computed)
+            computed.setflags(write=False)
+            computed = dict(zip(missing, computed))
+            for query, vector in computed.items():
+                self.query_cache.put(query, vector)
+            vectors = [computed[query] if vector is None else vector for query, vector in zip(queries, vectors)]
+        return np.vstack(vectors)
+
+    def search_ids(self, vectorstore, owners, candidates, queries, k, n_fields, fusion):
+        """
+        在给定的向量库快照中一次检索全部查询，并按问题合并字段得分。
+        每个问题最多 n_fields 个向量，取前 k * n_fields 个向量即可保证覆盖 max 融合的前 k 个问题。
+        :return: 每条查询一个元组，其中每个问题一个 (最接近字段的 FAISS 编号, 距离, 融合得分)，最相似的在前
+        """
+        vectors = self.embed_queries(queries, vectorstore._normalize_L2)
+        index = vectorstore.index
+        total = index.ntotal if candidates is None else len(candidates)
+        selector = None if candidates is None else faiss.IDSelectorBatch(candidates)
+        fetch = min(k * n_fields, total)
+        rerank = self.index_config.get('rerank') or 0
+        if rerank > 1 and not isinstance(index, faiss.IndexFlat):
+            # 量化索引先多取候选，再用磁盘缓存中的原始向量精确重排
+            candidates = index.search(vectors, min(fetch * rerank, total), params=search_params(index, self.index_config, selector))[1]
+            scores, ids = exact_rerank(vectors, candidates, self.exact_lookup(vectorstore), fetch, index.metric_type)
+        else:
+            scores, ids = index.search(vectors, fetch, params=search_params(index, self.index_config, selector))
+        return [self.merge_hits(row_scores, row_ids, owners, k, fusion) for row_scores, row_ids in zip(scores, ids)]
+
+    def exact_lookup(self, vectorstore):
+        """由 FAISS 编号取原始 float32 向量的函数，向量来自嵌入缓存（内存映射），不需要常驻内存"""
+        def lookup(ids):
+            texts = [vectorstore.docstore.text(int(i)) for i in ids]
+            vectors = self.embeddings.embed_array(texts)
+            if vectorstore._normalize_L2:
+                faiss.normalize_L2(vectors)
+            return vectors
+        return lookup
+
+    def merge_hits(self, scores, ids, owners, k, fusion):
+        """把一条查询命中的字段向量按问题合并，返回前 k 个问题"""
+        weights = source_path['search'].get('field_weights', {})
+        merged = {}
+        for score, faiss_id in zip(scores, ids):
+            if faiss_id == -1:
+                continue
+            issue_id, field = owners[faiss_id]
+            # 分数是 L2 距离，越小越相似；加权融合时换算为 (0, 1] 的相似度再求和
+            similarity = weights.get(field, 1.0) / (1.0 + float(score))
+            if issue_id not in merged:
+                merged[issue_id] = [int(faiss_id), float(score), similarity]
+            else:
+                merged[issue_id][2] += similarity
+        hits = list(merged.values())
+        if fusion == 'weighted':
+            hits.sort(key=lambda hit: -hit[2])
+        elif fusion == 'max':
+            # 检索结果已按距离升序，首次出现的字段就是最接近的字段
+            for hit in hits:
+                hit[2] = 1.0 / (1.0 + hit[1])
+        else:
+            raise ValueError(f"未知的融合方式 {fusion}，可选 max / weighted")
+        return tuple(tuple(hit) for hit in hits[:k])
+
+    def cache_stats(self):
+        """查询向量缓存、检索结果缓存和文档嵌入缓存的命中统计"""
+        return {
+            'query': self.query_cache.stats(),
+            'result': self.result_cache.stats(),
+            'embedding': self.embeddings.cache.stats(),
+        }
 
     def print_similar_issues(self, similar_issues):
         """打印相似问题记录的详细信息"""
@@ -292,6 +1039,53 @@ class Engine:
             print(f"  过孔填充类型: {issue['Via Plugging Type'] if issue['Via Plugging Type'] is not None else '无'}")
             print("-" * 50)
 
+_engines = {}
+_engines_lock = threading.Lock()
+
+def engine_key(vectorstore_path, output_excel, output_images_dir):
+    return (str(vectorstore_path), str(output_excel), str(output_images_dir))
+
+def warm_up(engine):
+    """计算一次嵌入，完成模型权重加载和推理初始化，首次检索不再等待"""
+    engine.embeddings.embed_queries(["warm up"])
+
+def load_engine(vectorstore_path, output_excel, output_images_dir, future):
+    """后台线程中构建 Engine 并预热，结果写入 future"""
+    try:
+        engine = Engine(vectorstore_path=vectorstore_path, output_excel=output_excel, output_images_dir=output_images_dir)
+        warm_up(engine)
+        future.set_result(engine)
+    except BaseException as e:
+        future.set_exception(e)
+
+def preload_engine(vectorstore_path=source_path['model'], output_excel=source_path['database'], output_images_dir=source_path['images']):
+    """
+    在后台线程中加载嵌入模型、向量索引和数据集，立即返回 Future。
+    同一组路径只加载一次；加载失败时下次调用重新尝试。
+    """
+    key = engine_key(vectorstore_path, output_excel, output_images_dir)
+    with _engines_lock:
+        future = _engines.get(key)
+        if future is None or (future.done() and future.exception() is not None):
+            future = _engines[key] = Future()
+            threading.Thread(
+                target=load_engine,
+                args=(vectorstore_path, output_excel, output_images_dir, future),
+                name="engine-loader",
+                daemon=True,
+            ).start()
+    return future
+
+def get_engine(vectorstore_path=source_path['model'], output_excel=source_path['database'], output_images_dir=source_path['images']):
+    """
+    进程内共享的 Engine：同一组路径只构建一次，所有会话共用嵌入模型、向量索引和数据集。
+    尚未加载时启动后台加载并等待完成；已加载时检查磁盘上的索引是否已更新，有变化时自动热重载。
+    """
+    future = preload_engine(vectorstore_path, output_excel, output_images_dir)
+    engine = future.result()
+    engine.reload_if_changed()
+    return engine
+
 # 示例用法
 if __name__ == "__main__":
     if not os.path.exists("faiss_index/index.faiss"):
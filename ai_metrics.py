@@ -0,0 +1,267 @@
+# ai_metrics.py
+import io
+import json
+import math
+import time
+import base64
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from config import source_path
+
+# 估算 token 数时每条消息的固定开销（角色和分隔符）和回答的起始标记，与 OpenAI 的计数方法一致
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+# gpt-4o 图片的 token 数：每张 85，high / auto 精度下每个 512x512 分块另加 170
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+
+# 当前调用发出的 HTTP 请求数，由 httpx 的请求钩子累加，多于 1 次即为重试
+_requests = contextvars.ContextVar('ai_requests', default=None)
+
+
+def count_request(request):
+    counter = _requests.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+async def acount_request(request):
+    count_request(request)
+
+
+def image_bytes(request):
+    """请求中图片 data URL 的字节数，即实际上传的 base64 图片大小"""
+    total = 0
+    for message in request.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, list):
+            total += sum(len(part['image_url']['url']) for part in content if part.get('type') == 'image_url')
+    return total
+
+
+def usage_metrics(usage):
+    """从回答的 usage 中取 token 数，没有 usage 时返回空字典"""
+    if usage is None:
+        return {}
+    return {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens, 'total_tokens': usage.total_tokens}
+
+
+_encoders = {}
+
+
+def token_encoder(model):
+    """
+    模型对应的 tiktoken 编码器，未知模型使用 o200k_base；
+    未安装 tiktoken 或无法下载编码文件（如离线环境）时返回 None
+    """
+    if model not in _encoders:
+        try:
+            import tiktoken
+        except ImportError:
+            _encoders[model] = None
+        else:
+            try:
+                try:
+                    _encoders[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encoders[model] = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                _encoders[model] = None
+    return _encoders[model]
+
+
+def count_tokens(text, model):
+    """文本的 token 数；没有 tiktoken 时按 ASCII 约 4 个字符 1 个 token、其他字符（如中文）每字 1 个 token 估算"""
+    if not text:
+        return 0
+    encoder = token_encoder(model)
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    ascii_chars = sum(ch.isascii() for ch in text)
+    return math.ceil(ascii_chars / 4) + len(text) - ascii_chars
+
+
+def image_tokens(image_url):
+    """
+    按 gpt-4o 的规则估算一张图片的 token 数：low 精度固定 85；
+    其他精度先缩放到 2048x2048 以内、短边不超过 768，再按 512x512 分块计数
+    """
+    if image_url.get('detail') == 'low':
+        return IMAGE_BASE_TOKENS
+    try:
+        from PIL import Image
+        # 只读取图片头部得到尺寸，不解码像素
+        with Image.open(io.BytesIO(base64.b64decode(image_url['url'].split(",", 1)[1]))) as image:
+            width, height = image.size
+    except Exception:
+        return IMAGE_BASE_TOKENS
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def estimate_usage(request, text):
+    """
+    服务端没有返回 usage 时（如未开启 stream_usage 的流式回答）由请求和回答文本估算 token 数，
+    结果带 usage_estimated 标记
+    """
+    model = request.get('model')
+    prompt_tokens = TOKENS_PER_REPLY
+    for message in request.get('messages', []):
+        prompt_tokens += TOKENS_PER_MESSAGE + count_tokens(message.get('role'), model)
+        content = message.get('content')
+        if isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'image_url':
+                    prompt_tokens += image_tokens(part['image_url'])
+                else:
+                    prompt_tokens += count_tokens(part.get('text'), model)
+        else:
+            prompt_tokens += count_tokens(content, model)
+    completion_tokens = count_tokens(text, model)
+    return {
+        'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens, 'usage_estimated': True,
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AIMetrics:
+    """
+    进程内的模型调用统计：按模型累计调用次数、错误、缓存命中、重试、token 和图片字节数，
+    最近 window 次调用的延迟用于计算分位数；配置了 log_path 时每次调用另写一行 JSON 到滚动日志
+    """
+
+    def __init__(self, window=1000, log_path=None, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self._lock = threading.Lock()
+        self.window = window
+        self.totals = {}
+        self.latencies = deque(maxlen=window)
+        self.first_tokens = deque(maxlen=window)
+        self.waits = deque(maxlen=window)
+        self.started = time.time()
+        self.logger = None
+        if log_path:
+            Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger = logging.getLogger(f"{__name__}.{log_path}")
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            self.logger.addHandler(handler)
+
+    def record(self, call):
+        """记录一次调用，call 为 track() 生成的字典"""
+        with self._lock:
+            totals = self.totals.setdefault(call['model'], {
+                'calls': 0, 'errors': 0, 'cache_hits': 0, 'retries': 0, 'estimated_calls': 0,
+                'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'image_bytes': 0, 'total_latency_ms': 0.0,
+            })
+            totals['calls'] += 1
+            totals['errors'] += call['error'] is not None
+            totals['cache_hits'] += call['cache_hit']
+            totals['estimated_calls'] += bool(call.get('usage_estimated'))
+            for key in ('retries', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'image_bytes'):
+                totals[key] += call.get(key) or 0
+            totals['total_latency_ms'] += call['latency_ms']
+            if not call['cache_hit']:
+                self.latencies.append(call['latency_ms'])
+                self.waits.append(call['wait_ms'])
+                if call.get('first_token_ms') is not None:
+                    self.first_tokens.append(call['first_token_ms'])
+        if self.logger is not None:
+            self.logger.info(json.dumps(call, ensure_ascii=False))
+
+    def snapshot(self):
+        """
+        当前统计的快照
+        :return: {'since', 'calls', 'errors', 'cache_hits', 'cache_hit_rate', 'retries', token 和图片字节合计,
+                  'estimated_calls'（token 数为估算值的调用数）,
+                  'latency_ms' / 'first_token_ms' / 'wait_ms' 的 mean/p50/p95/max（不含缓存命中）, 'models': 按模型的合计}
+        """
+        with self._lock:
+            models = {model: dict(totals) for model, totals in self.totals.items()}
+            series = {'latency_ms': list(self.latencies), 'first_token_ms': list(self.first_tokens), 'wait_ms': list(self.waits)}
+        summary = {'since': self.started}
+        for key in ('calls', 'errors', 'cache_hits', 'retries', 'estimated_calls', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'image_bytes'):
+            summary[key] = sum(totals[key] for totals in models.values())
+        summary['cache_hit_rate'] = summary['cache_hits'] / summary['calls'] if summary['calls'] else 0.0
+        for key, values in series.items():
+            summary[key] = {
+                'mean': sum(values) / len(values) if values else None,
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'max': max(values) if values else None,
+            }
+        summary['models'] = models
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self.totals.clear()
+            self.latencies.clear()
+            self.first_tokens.clear()
+            self.waits.clear()
+            self.started = time.time()
+
+
+@contextmanager
+def track(kind, request, metrics=None):
+    """
+    统计一次模型调用：耗时、HTTP 请求重试次数和图片字节数，结束（包括出错）时写入 metrics。
+    调用方在产出的字典中补充 cache_hit、token 数、wait_ms 和 first_token_ms
+    """
+    metrics = metrics or get_metrics()
+    call = {
+        'time': time.time(), 'kind': kind, 'model': request.get('model'), 'cache_hit': False,
+        'image_bytes': image_bytes(request), 'retries': 0, 'wait_ms': 0.0, 'first_token_ms': None, 'error': None,
+    }
+    counter = [0]
+    token = _requests.set(counter)
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        call['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        call['latency_ms'] = (time.perf_counter() - start) * 1000
+        call['retries'] = max(0, counter[0] - 1)
+        try:
+            _requests.reset(token)
+        except ValueError:
+            # 生成器在其他上下文中结束时无法恢复，直接清空
+            _requests.set(None)
+        metrics.record(call)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics(config=None):
+    """进程内共享的统计对象，按 config.source_path['ai_metrics'] 创建"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            config = config or source_path['ai_metrics']
+            _metrics = AIMetrics(config.get('window', 1000), config.get('log_path'), config.get('max_bytes', 10 * 1024 * 1024), config.get('backup_count', 5))
+    return _metrics
+
+
+def snapshot():
+    """进程内模型调用统计的快照，见 AIMetrics.snapshot"""
+    return get_metrics().snapshot()
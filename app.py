@@ -2,8 +2,7 @@
 import streamlit as st
 from config import APP_CONFIG, MESSAGES, LANGUAGES
 import pandas as pd 
-from utils import load_from_dataset
-from EC import Engine
+from utils import load_record_store
 # 设置页面配置（仅在此处调用一次）
 st.set_page_config(
     page_title="STG 应用",
@@ -16,8 +15,7 @@ st.logo(APP_CONFIG["logo_path"], size=APP_CONFIG["logo_size"])
 if "language" not in st.session_state:
     st.session_state.language = "zh-CN"  # 默认简体中文
 
-if 'engine' not in st.session_state:
-    st.session_state["engine"] = Engine(vectorstore_path="Data/Model", output_excel="Data/Dataset.csv", output_images_dir="Data/images")
+# 检索用的 Engine 由创建页面在后台按需加载，其他页面启动时不导入 torch / LangChain
 
 
 # 获取当前语言
@@ -72,9 +70,8 @@ with open("styles.css", "r") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
 
-## 加载全局数据
-if st.session_state.get('data') is None:
-    st.session_state['data'] = load_from_dataset()
+## 加载全局数据（所有会话共享同一份只读记录存储；load_record_store 检查数据集文件的修改时间，数据集更新后换成新实例）
+st.session_state['data'] = load_record_store()
 
 # 运行导航
 navigation.run()
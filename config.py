@@ -910,7 +910,76 @@ source_path = {'database':database_dir,
                 'model':model_dir,
                 'EQ excel':EQ_excel_dir,
                 'embedding': 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2',
+                'embedding_cache': {
+                            'path': project_root / "Data" / "Embeddings",  # 按 (模型名, 文本哈希) 缓存的文档向量
+                            'batch_size': 64,
+                            'threads': None,  # CPU 推理线程数，None 表示使用 torch 默认值
+    },
                 'search': {
                             'default_k': 20,
                             'similarity_threshold': 0.7,
+                            'query_cache_size': 256,  # 查询向量 LRU 缓存条数
+                            'result_cache_size': 256,  # 检索结果 LRU 缓存条数
+                            'fusion': 'max',  # 多字段得分合并方式：max（最接近的字段）/ weighted（加权和）
+                            'field_weights': {'Description': 1.0, 'Factory Suggestion': 0.5, 'STG Proposal': 0.5, 'Customer Decision': 0.5},
+    },
+                'hybrid': {
+                            # 参与 BM25 词法检索的字段，嵌套字段取其文本
+                            'fields': ['Description', 'Factory Suggestion', 'STG Proposal', 'Customer Decision',
+                                       'Customer P/N', 'Factory P/N', 'STG P/N', 'Base Material', 'Solder Mask', 'Via Plugging Type'],
+                            'k1': 1.5,
+                            'b': 0.75,
+                            'rrf_k': 60,  # 倒数排名融合常数
+                            'depth': 50,  # 每路检索参与融合的结果数
+    },
+                'ingest': {
+                            'workers': None,  # None 表示使用全部 CPU 核心
+    },
+                'index': {
+                            'type': 'flat',  # flat（精确）/ ivf_flat / ivf_pq / hnsw / sq8（int8 量化）/ sq_fp16（float16）
+                            # 建立向量的文本字段，每个问题的每个字段一个向量；修改后需重建向量模型
+                            'fields': ['Description', 'Factory Suggestion', 'STG Proposal', 'Customer Decision'],
+                            'nlist': None,  # IVF 聚类数，None 表示 4*sqrt(N)
+                            'nprobe': 8,  # IVF 检索时访问的聚类数
+                            'pq_m': 16,  # PQ 子空间数，需整除向量维度
+                            'pq_nbits': 8,
+                            'hnsw_m': 32,
+                            'efConstruction': 40,
+                            'efSearch': 64,  # HNSW 检索时的候选队列长度
+                            'rerank': 0,  # 大于 1 时近似或量化索引先取 rerank 倍候选，再用原始向量精确重排
+    },
+                'ai': {
+                            'endpoint': "https://hkust.azure-api.net",  # 本地测试时可改为兼容 OpenAI 的模拟服务地址
+                            'api_version': "2023-05-15",
+                            'timeout': 60,  # 单次请求总超时（秒）
+                            'connect_timeout': 10,  # 建立连接超时（秒）
+                            'max_connections': 20,  # 连接池最大连接数
+                            'max_keepalive': 10,  # 保持的空闲长连接数
+                            'keepalive_expiry': 30,  # 空闲长连接保留时间（秒）
+                            'max_concurrency': 4,  # 进程内同时发往模型的请求数上限
+                            'max_retries': 2,
+                            'stream_usage': False,  # 流式回答是否由服务端返回 token 用量（stream_options，需 2024-09-01-preview 及以上的 API 版本和 openai >= 1.26）；关闭时按 tiktoken 估算
+    },
+                'ai_cache': {
+                            'path': project_root / "Data" / "AICache" / "responses.sqlite",  # AI 写作回答的持久缓存
+                            'ttl': 7 * 24 * 3600,  # 缓存有效期（秒）
+                            'max_entries': 5000,  # 超过后删除最久未使用的条目
+                            'cacheable_temperature': 1,  # 只缓存 temperature 不超过该值的请求，0 表示只缓存确定性请求
+                            'deterministic': False,  # 为 True 时请求统一使用 temperature=0 和固定 seed，重复提问得到相同回答
+                            'seed': 0,
+    },
+                'ai_images': {
+                            'detail': 'high',  # 图像理解精度 low / high / auto，决定上传前缩放到的分辨率
+                            # 各精度的目标尺寸：长边不超过 max_side，短边不超过 short_side（与模型内部缩放规则一致，更大的图片只增加上传量）
+                            'max_side': {'low': 512, 'high': 2048, 'auto': 2048},
+                            'short_side': {'low': 512, 'high': 768, 'auto': 768},
+                            'format': 'JPEG',  # 重新编码格式 JPEG / WEBP
+                            'quality': 85,
+                            'cache_size': 64,  # 缓存的编码结果数
+    },
+                'ai_metrics': {
+                            'window': 1000,  # 计算延迟分位数使用的最近调用数
+                            'log_path': None,  # 每次调用写一行 JSON 的滚动日志，如 project_root / "Data" / "Logs" / "ai_calls.jsonl"；None 表示不写
+                            'max_bytes': 10 * 1024 * 1024,  # 单个日志文件大小上限
+                            'backup_count': 5,  # 保留的历史日志文件数
     }}
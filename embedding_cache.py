@@ -0,0 +1,262 @@
+# embedding_cache.py
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import source_path
+
+
+def text_key(text):
+    """文本的缓存键：UTF-8 内容的 SHA-256"""
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程的排他文件锁，同一缓存目录的多个实例（包括其他进程）依次追加"""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    """
+    单个嵌入模型的磁盘缓存。
+    向量按行追加到 float32 文件 vectors.f32 并以内存映射方式读取，keys.txt 按相同顺序保存每行文本的哈希。
+    先写向量再写键，中断时多出的向量行在下次加锁读取时截掉，新向量的行号始终等于已写入的键数。
+    追加时持有目录下的文件锁，同一目录的多个实例或多个进程不会交错写入。
+    """
+
+    def __init__(self, cache_dir, model_name):
+        self.model_name = model_name
+        # 不同模型（或同一模型的不同版本）各用一个目录，互不覆盖
+        self.path = os.path.join(str(cache_dir), hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:16])
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.keys_path = os.path.join(self.path, "keys.txt")
+        self.meta_path = os.path.join(self.path, "meta.json")
+        self.lock_path = os.path.join(self.path, "lock")
+        self._lock = threading.Lock()
+        self.dim = None
+        self.rows = {}
+        # 键文件的行数，即向量文件中有效的行数（重复的键各占一行）
+        self.count = 0
+        self.keys_offset = 0
+        self._matrix = None
+        self.hits = 0
+        self.misses = 0
+        self.open()
+
+    def open(self):
+        """读取已有的键和维度，向量在第一次取用时才映射"""
+        if not os.path.exists(self.meta_path):
+            return
+        with self._lock, file_lock(self.lock_path):
+            self.refresh()
+
+    def refresh(self):
+        """
+        读取其他实例追加的键，并把向量文件截断到与键数一致；调用方需持有文件锁。
+        键文件只读取已完整写入的行
+        """
+        if self.dim is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)['dim']
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                f.seek(self.keys_offset)
+                data = f.read()
+            data = data[:data.rfind(b"\n") + 1]
+            for key in data.decode("utf-8").split():
+                self.rows.setdefault(key, self.count)
+                self.count += 1
+            self.keys_offset += len(data)
+        row_bytes = 4 * self.dim
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if size > self.count * row_bytes:
+            # 写入向量后、写入键之前中断留下的多余行
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(self.count * row_bytes)
+        elif size < self.count * row_bytes:
+            # 向量文件缺行时只保留有向量的键
+            self.count = size // row_bytes
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                keys = f.read().split()[:self.count]
+            with open(self.keys_path, "w", encoding="utf-8") as f:
+                f.write("".join(f"{key}\n" for key in keys))
+            self.rows = {}
+            for i, key in enumerate(keys):
+                self.rows.setdefault(key, i)
+            self.keys_offset = os.path.getsize(self.keys_path)
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(self.count * row_bytes)
+            self._matrix = None
+
+    def matrix(self):
+        """以只读内存映射返回全部缓存向量"""
+        if self._matrix is None or len(self._matrix) < self.count:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim)) if self.count else np.zeros((0, self.dim or 0), dtype=np.float32)
+        return self._matrix
+
+    def get(self, keys):
+        """返回 (已缓存键的行号列表, 未缓存的键)"""
+        found = [self.rows.get(key) for key in keys]
+        missing = [key for key, row in zip(keys, found) if row is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return found, missing
+
+    def put(self, keys, vectors):
+        """追加新向量，已存在的键（包括其他实例刚写入的）会被跳过"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock, file_lock(self.lock_path):
+            self.refresh()
+            new = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows:
+                    new.setdefault(key, vector)
+            if not new:
+                return
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({'model': self.model_name, 'dim': self.dim}, f)
+            # 行号取自向量文件的实际长度，refresh 之后与键数一致
+            start = (os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0) // (4 * self.dim)
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.stack(list(new.values())).tobytes())
+            with open(self.keys_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{key}\n" for key in new))
+            for i, key in enumerate(new):
+                self.rows[key] = start + i
+            self.count = start + len(new)
+            self.keys_offset = os.path.getsize(self.keys_path)
+
+    def stats(self):
+        """命中次数、未命中次数和已缓存的向量数"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.rows)}
+
+
+class LRUCache:
+    """线程安全的有界 LRU 缓存，记录命中率"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """清空缓存内容，保留命中计数"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """命中次数、未命中次数、命中率和当前条目数"""
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0, 'size': len(self._data)}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带磁盘缓存的嵌入模型：文档文本按 (模型名, 文本哈希) 缓存，重建索引时只计算从未嵌入过的文本。
+    可直接替代 HuggingFaceEmbeddings 传给 FAISS。
+    """
+
+    def __init__(self, base, model_name, cache_dir, batch_size=64):
+        self.base = base
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache = EmbeddingCache(cache_dir, model_name)
+
+    def embed_array(self, texts):
+        """嵌入一组文本，返回 float32 矩阵 (n, dim)"""
+        keys = [text_key(text) for text in texts]
+        found, missing = self.cache.get(keys)
+        if missing:
+            # 同一批中重复的文本只计算一次
+            pending = dict(zip(keys, texts))
+            missing = list(dict.fromkeys(missing))
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                self.cache.put(batch, self.base.embed_documents([pending[key] for key in batch]))
+                print(f"嵌入计算 {min(start + self.batch_size, len(missing))}/{len(missing)}")
+            found = [self.cache.rows[key] for key in keys]
+        if not keys:
+            return np.zeros((0, self.cache.dim or 0), dtype=np.float32)
+        return np.array(self.cache.matrix()[found])
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.base.embed_query(text)
+
+    def embed_queries(self, texts):
+        """批量计算查询向量，不写入磁盘缓存，返回 float32 矩阵 (n, dim)"""
+        return np.array(self.base.embed_documents(list(texts)), dtype=np.float32)
+
+
+def load_embeddings(model_name=None, config=None):
+    """
+    创建带缓存的嵌入模型。
+    :param model_name: 模型名称，默认 config.source_path['embedding']
+    :param config: 缓存目录、批大小和 CPU 线程数，默认 config.source_path['embedding_cache']
+    """
+    # torch / sentence-transformers 只在真正需要嵌入模型时导入
+    from langchain_huggingface import HuggingFaceEmbeddings
+    model_name = model_name or source_path['embedding']
+    config = config or source_path['embedding_cache']
+    if config.get('threads'):
+        import torch
+        torch.set_num_threads(config['threads'])
+    base = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'batch_size': config.get('batch_size', 64)},
+    )
+    return CachedEmbeddings(base, model_name, config['path'], batch_size=config.get('batch_size', 64))
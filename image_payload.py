@@ -0,0 +1,129 @@
+# image_payload.py
+import io
+import os
+import base64
+import hashlib
+from collections import namedtuple
+from PIL import Image
+from config import source_path
+from embedding_cache import LRUCache
+
+# 可直接上传、无需转换格式的图像格式
+UPLOAD_FORMATS = {'JPEG': "image/jpeg", 'PNG': "image/png", 'WEBP': "image/webp"}
+
+# 编码结果：MIME 类型、base64 数据、原图字节数、上传字节数、是否重新编码
+EncodedImage = namedtuple('EncodedImage', ['mime', 'data', 'source_bytes', 'payload_bytes', 'reencoded'])
+
+_payloads = {}
+
+
+def payload_cache(config):
+    """进程内共享的编码结果缓存，同一张图片重复提问时不再重新缩放和编码"""
+    size = config.get('cache_size', 64)
+    if size not in _payloads:
+        _payloads[size] = LRUCache(size)
+    return _payloads[size]
+
+
+def source_data(image):
+    """原图文件的字节内容：优先从仍然打开的文件对象（如上传的文件）读取，其次按文件名读取，都不可用时返回 None"""
+    fp = getattr(image, 'fp', None)
+    try:
+        if hasattr(fp, 'getvalue'):
+            return fp.getvalue()
+        fp.seek(0)
+        return fp.read()
+    except (AttributeError, OSError, ValueError):
+        pass
+    filename = getattr(image, 'filename', None)
+    if filename and os.path.exists(filename):
+        with open(filename, "rb") as f:
+            return f.read()
+    return None
+
+
+def matches_source(image, data):
+    """原文件的尺寸和色彩模式与当前图像一致，即图像打开后没有在内存中缩放、旋转或转换（只读取文件头）"""
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            return source.size == image.size and source.mode == image.mode
+    except OSError:
+        return False
+
+
+def target_size(size, detail, config):
+    """按精度计算目标尺寸：等比缩小到长边不超过 max_side、短边不超过 short_side，不放大"""
+    width, height = size
+    scale = min(
+        1.0,
+        config['max_side'][detail] / max(width, height),
+        config['short_side'][detail] / min(width, height),
+    )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def encode(image, size, config):
+    """缩放并按配置的格式和质量重新编码"""
+    image_format = config.get('format', 'JPEG').upper()
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        # JPEG 不支持透明通道，透明部分以白色填充
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    buffered = io.BytesIO()
+    image.save(buffered, format=image_format, quality=config.get('quality', 85), optimize=image_format == 'JPEG')
+    return UPLOAD_FORMATS[image_format], buffered.getvalue()
+
+
+def encode_image(image, detail=None, config=None):
+    """
+    上传前的图像预处理：按精度缩放到目标分辨率并重新编码为 base64。
+    原图已是可上传格式且不超过目标尺寸时直接使用原文件，不重新编码；结果按内容哈希缓存
+    :param image: PIL Image
+    :param detail: 图像理解精度 low / high / auto，默认 config['detail']
+    :param config: 预处理配置，默认 config.source_path['ai_images']
+    :return: EncodedImage
+    """
+    config = config or source_path['ai_images']
+    detail = detail or config.get('detail', 'high')
+    data = source_data(image)
+    if data is not None and not matches_source(image, data):
+        # 打开后修改过的图像（如 thumbnail、exif_transpose）与原文件不同，按当前像素处理
+        data = None
+    digest = hashlib.sha256(data if data is not None else image.tobytes()).hexdigest()
+    key = (digest, image.size, detail, config.get('format'), config.get('quality'))
+    cache = payload_cache(config)
+    encoded = cache.get(key)
+    if encoded is not None:
+        return encoded
+
+    size = target_size(image.size, detail, config)
+    if data is not None and image.format in UPLOAD_FORMATS and size == image.size:
+        encoded = EncodedImage(UPLOAD_FORMATS[image.format], base64.b64encode(data).decode("utf-8"), len(data), len(data), False)
+    else:
+        mime, payload = encode(image, size, config)
+        if data is None:
+            # 没有原文件时以原来的做法（原分辨率 PNG）估算原图大小
+            buffered = io.BytesIO()
+            image.save(buffered, format='PNG')
+            data = buffered.getvalue()
+        encoded = EncodedImage(mime, base64.b64encode(payload).decode("utf-8"), len(data), len(payload), True)
+    cache.put(key, encoded)
+    return encoded
+
+
+def payload_stats(encoded):
+    """一组编码结果的字节统计：原图字节数、上传字节数和节省的字节数"""
+    source_bytes = sum(item.source_bytes for item in encoded)
+    payload_bytes = sum(item.payload_bytes for item in encoded)
+    return {
+        'images': len(encoded),
+        'reencoded': sum(item.reencoded for item in encoded),
+        'source_bytes': source_bytes,
+        'payload_bytes': payload_bytes,
+        'saved_bytes': source_bytes - payload_bytes,
+    }
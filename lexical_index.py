@@ -0,0 +1,129 @@
+# lexical_index.py
+import os
+import re
+import json
+import math
+from collections import Counter
+
+# 英文数字词（保留 H-9100、04R012526.A00 这类料号整体）以及单个中文字符
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./_][a-z0-9]+)*|[一-鿿]")
+
+
+def tokenize(text):
+    """
+    分词：小写后按 TOKEN_PATTERN 切分。
+    带连接符的料号同时保留整体和各部分，精确料号和部分料号都能命中
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(str(text).lower()):
+        tokens.append(token)
+        parts = re.split(r"[-./_]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+def issue_text(issue, fields):
+    """拼接问题记录中参与词法检索的字段文本，嵌套字段取其 text"""
+    texts = []
+    for field in fields:
+        value = issue.get(field)
+        if isinstance(value, dict):
+            value = value.get('text')
+        if value is not None:
+            texts.append(str(value))
+    return "\n".join(texts)
+
+
+class BM25Index:
+    """
+    内存中的 BM25 倒排索引，文档以问题 Index 为键。
+    updated() 返回修改后的新索引，原索引不变，正在进行的检索不受影响。
+    """
+
+    def __init__(self, docs=None, k1=1.5, b=0.75):
+        """
+        :param docs: {问题 Index: {词: 词频}}
+        """
+        self.k1 = k1
+        self.b = b
+        self.docs = docs or {}
+        self.lengths = {doc_id: sum(terms.values()) for doc_id, terms in self.docs.items()}
+        self.total_length = sum(self.lengths.values())
+        self.postings = {}
+        for doc_id, terms in self.docs.items():
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+
+    @classmethod
+    def from_issues(cls, issues, fields, k1=1.5, b=0.75):
+        """由问题记录构建索引"""
+        return cls({issue['Index']: dict(Counter(tokenize(issue_text(issue, fields)))) for issue in issues}, k1, b)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def updated(self, remove_ids=(), issues=(), fields=()):
+        """返回删除 remove_ids、添加（或替换）issues 后的新索引"""
+        docs = dict(self.docs)
+        for doc_id in remove_ids:
+            docs.pop(doc_id, None)
+        for issue in issues:
+            docs[issue['Index']] = dict(Counter(tokenize(issue_text(issue, fields))))
+        return BM25Index(docs, self.k1, self.b)
+
+    def search(self, query, k=20, allowed=None):
+        """
+        BM25 检索
+        :param allowed: 只返回这些问题 Index，None 表示不过滤
+        :return: [(问题 Index, BM25 分数)]，分数高的在前
+        """
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        average_length = self.total_length / n
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+    def save(self, path):
+        """原子写入 JSON 文件"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'version': 1, 'k1': self.k1, 'b': self.b, 'docs': [[doc_id, terms] for doc_id, terms in self.docs.items()]}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取索引文件，不存在或损坏时返回 None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print(f"词法索引 {path} 无法读取，将重新构建")
+            return None
+        return cls({doc_id: terms for doc_id, terms in data['docs']}, data.get('k1', 1.5), data.get('b', 0.75))
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """
+    倒数排名融合：每个排名列表中排第 r 位（从 1 开始）的条目得分 1 / (rrf_k + r)，跨列表求和
+    :param rankings: 若干按相关度排好序的键列表
+    :return: [(键, 融合得分)]，得分高的在前
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
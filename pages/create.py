@@ -5,7 +5,7 @@ from utils import initialize_session_state, render_QA_card
 from config import DATE_FORMAT, MESSAGES, LANGUAGES, source_path
 from PIL import Image
 from ustai import AI
-from EC import Engine
+from EC import get_engine, preload_engine
 import os 
 
 # Initialize session state
@@ -53,13 +53,12 @@ empty_eq_card_temp = {
     "Closed Date": "3000-01-01"
 }
 
-# Initialize engine and session state variables
-if 'engine' not in st.session_state:
-    st.session_state["engine"] = Engine(
-        vectorstore_path=source_path["model"],
-        output_excel=source_path["database"],
-        output_images_dir=source_path["images"]
-    )
+# Start loading the shared engine in the background; the first search waits for it
+preload_engine(
+    vectorstore_path=source_path["model"],
+    output_excel=source_path["database"],
+    output_images_dir=source_path["images"]
+)
 if 'cEQ' not in st.session_state:
     st.session_state["cEQ"] = {'index': None, 'question': empty_eq_card_temp}
 if "search_button" not in st.session_state:
@@ -74,7 +73,12 @@ def validate_index(index, questions):
 # Search function
 def searching(final_description, customer_name):
     with st.spinner(MESSAGES[current_language]["searching"]):
-        similar_issues = st.session_state.engine.search_similar_descriptions(
+        engine = get_engine(
+            vectorstore_path=source_path["model"],
+            output_excel=source_path["database"],
+            output_images_dir=source_path["images"]
+        )
+        similar_issues = engine.search_similar_descriptions(
             final_description,
             customer_name=customer_name,
             k=source_path["search"]["default_k"]
@@ -137,16 +141,17 @@ def render_question_form(info, index):
         convert = st.button(MESSAGES[current_language]["aiWriter"], key=f"convert_{index}")
         text = ''
         if convert:
+            # 流式输出，生成的文字逐段显示，不必等整段回答完成
             if current_images:
-                text = AI().analyze_image(
+                text = st.write_stream(AI().stream_image(
                     [Image.open(i) for i in current_images],
                     prompt=MESSAGES[current_language]["aiWriter"].format(question=question)
-                )
+                ))
             else:
-                text = AI().get_response(
+                text = st.write_stream(AI().stream_response(
                     question,
                     MESSAGES[current_language]["aiWriter"]
-                )
+                ))
             info.update({"Description": {'text': text, 'image': current_images}})
 
         final_description = st.text_area(
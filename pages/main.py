@@ -1,8 +1,8 @@
 import streamlit as st
 import plotly.graph_objects as go
 import datetime
-from utils import load_from_dataset
-from config import source_path, MESSAGES
+from utils import load_record_store
+from config import MESSAGES
 
 # Initialize session_state
 if 'navigate_to' not in st.session_state:
@@ -10,7 +10,7 @@ if 'navigate_to' not in st.session_state:
 if 'filter_days' not in st.session_state:
     st.session_state.filter_days = None
 if "data" not in st.session_state:
-    st.session_state.data = load_from_dataset(input_excel=source_path['database'])
+    st.session_state.data = load_record_store()
 if 'language' not in st.session_state:
     st.session_state.language = 'en'  # Default to English
 
@@ -3,6 +3,7 @@ import pandas as pd
 from models import EQ
 from config import MESSAGES, DATE_FORMAT
 import math
+import copy
 import datetime
 from utils import show_error_message
 
@@ -301,9 +302,8 @@ def edit_eq(selected_rows):
             'Solder Mask': eq_data.get('Solder Mask', ''),
         }
 
-        questions = []
-        eq_list_entry = [item for item in st.session_state.data if item.get('FileName') == filepath]
-        questions = eq_list_entry
+        # 共享记录只读，编辑前复制一份
+        questions = [copy.deepcopy(dict(item)) for item in st.session_state.data if item.get('FileName') == filepath]
 
         st.session_state.current_eq = eq_info
         st.session_state.questions = questions
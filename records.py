@@ -0,0 +1,119 @@
+# records.py
+from collections import namedtuple
+from collections.abc import Sequence
+from types import MappingProxyType
+
+# 一条检索结果：问题 Index 和距离（越小越相似），不可变
+SearchHit = namedtuple('SearchHit', ['id', 'score'])
+
+
+class IssueRecords(Sequence):
+    """
+    按列存储的只读问题记录集合。
+    加载时只做整列运算，访问某一行时才还原为 load_from_dataset 原有的字典结构，
+    还原结果会被缓存，重复遍历不会重复构建。
+    行以只读映射返回，同一个实例可以在多个会话和 Engine 之间共享；需要修改时请先 dict() 复制。
+    """
+
+    def __init__(self, fields, length):
+        """
+        :param fields: [(key, nested, values, images)] 列表，按原字典的键顺序排列。
+            nested 为 False 时 values 为该列的值数组（缺失值为 None）；
+            nested 为 True 时 values 为文本数组（可为 None），images 为 (扁平图片名数组, 每行起止偏移) 或 None
+        :param length: 记录条数
+        """
+        self._fields = fields
+        self._length = length
+        self._rows = [None] * length
+        self._positions = None
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("record index out of range")
+        row = self._rows[index]
+        if row is None:
+            row = self._rows[index] = self._materialize(index)
+        return row
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self[i]
+
+    def __getstate__(self):
+        """序列化时不保存已还原的行和索引"""
+        state = self.__dict__.copy()
+        state['_rows'] = [None] * self._length
+        state['_positions'] = None
+        return state
+
+    def position(self, record_id):
+        """按 Index 列的值查找行号，找不到时返回 None"""
+        if self._positions is None:
+            ids = next((values for key, nested, values, images in self._fields if key == 'Index'), None)
+            self._positions = {} if ids is None else {value: i for i, value in enumerate(ids)}
+        return self._positions.get(record_id)
+
+    def get_by_id(self, record_id, default=None):
+        """按 Index 列的值取记录"""
+        position = self.position(record_id)
+        return default if position is None else self[position]
+
+    def _materialize(self, index):
+        """还原单行：跳过缺失值，以及文本和图片都为空的字段"""
+        issue = {}
+        for key, nested, values, images in self._fields:
+            if not nested:
+                value = values[index]
+                if value is not None:
+                    issue[key] = value
+                continue
+            text = values[index] if values is not None else None
+            image = []
+            if images is not None:
+                flat, offsets = images
+                image = flat[offsets[index]:offsets[index + 1]].tolist()
+            if text is not None or image:
+                issue[key] = {'text': text, 'image': image}
+        return MappingProxyType(issue)
+
+
+class SearchResults(Sequence):
+    """
+    检索结果：hits 为按相似度排好序的 SearchHit，只保存编号和分数。
+    访问某一条时才从记录表取出记录，返回附带 similarity_score 等字段的副本，不修改共享记录。
+    """
+
+    def __init__(self, hits, records, details=None):
+        """
+        :param hits: SearchHit 元组
+        :param records: 记录表，提供 get_by_id
+        :param details: 每条结果附加到记录副本上的字段字典，与 hits 一一对应
+        """
+        self.hits = tuple(hits)
+        self._records = records
+        self._details = details or [{} for hit in self.hits]
+        self._rows = [None] * len(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        row = self._rows[index]
+        if row is None:
+            hit = self.hits[index]
+            record = self._records.get_by_id(hit.id, {'Index': hit.id})
+            row = self._rows[index] = {**record, 'similarity_score': hit.score, **self._details[index]}
+        return row
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
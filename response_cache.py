@@ -0,0 +1,123 @@
+# response_cache.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from config import source_path
+
+# 未指定 temperature 时模型使用的默认值
+DEFAULT_TEMPERATURE = 1
+
+
+def content_hash(text):
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+
+def request_key(request):
+    """
+    请求的缓存键：模型、temperature、指令和问题文本等全部请求参数的哈希。
+    图片的 base64 数据先替换为其内容哈希，键本身不随图片大小增长
+    """
+    messages = []
+    for message in request.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, list):
+            content = [
+                {'type': 'image_url', 'image_url': {'sha256': content_hash(part['image_url']['url'])}}
+                if part.get('type') == 'image_url' else part
+                for part in content
+            ]
+        messages.append({**message, 'content': content})
+    payload = {key: value for key, value in request.items() if key not in ('messages', 'stream')}
+    payload['messages'] = messages
+    return content_hash(json.dumps(payload, sort_keys=True, ensure_ascii=False))
+
+
+class ResponseCache:
+    """
+    SQLite 中的模型回答缓存，值为完整回答的 JSON。
+    超过 ttl 的条目视为未命中并删除；条目数超过 max_entries 时删除最久未使用的条目
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @contextmanager
+    def connect(self):
+        """打开连接并在一个事务中执行，结束后关闭；不同线程（Streamlit 会话）之间不共享连接"""
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        """返回缓存的回答 JSON，未命中或已过期时返回 None"""
+        now = time.time()
+        with self._lock, self.connect() as db:
+            row = db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock, self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)", (key, value, now, now))
+            if self.max_entries:
+                db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def purge(self):
+        """删除全部过期条目，返回删除的条目数"""
+        if not self.ttl:
+            return 0
+        with self._lock, self.connect() as db:
+            return db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)).rowcount
+
+    def clear(self):
+        with self._lock, self.connect() as db:
+            db.execute("DELETE FROM responses")
+
+    def stats(self):
+        """命中次数、未命中次数、命中率和当前条目数"""
+        with self.connect() as db:
+            size = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0, 'size': size}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(config=None):
+    """进程内共享的回答缓存，同一个文件只打开一次，命中统计在所有会话间累计"""
+    config = config or source_path['ai_cache']
+    with _caches_lock:
+        cache = _caches.get(str(config['path']))
+        if cache is None:
+            cache = _caches[str(config['path'])] = ResponseCache(config['path'], config.get('ttl'), config.get('max_entries'))
+    return cache
@@ -0,0 +1,123 @@
+# side_store.py
+import os
+import json
+from collections.abc import Mapping
+import numpy as np
+
+# 侧文件：每个 FAISS 编号对应的问题 Index 和字段编码，以及字段名和 FAISS 参数，均不需要 pickle
+IDS_FILE = "docs.ids.npy"
+FIELDS_FILE = "docs.fields.npy"
+META_FILE = "docs.meta.json"
+
+
+def has_side_store(path):
+    return os.path.exists(os.path.join(str(path), META_FILE))
+
+
+class IdDocstore:
+    """
+    只保存编号的 docstore：第 i 个 FAISS 向量对应 (问题 Index, 字段)，不保存文本和记录。
+    LangChain 的 FAISS 只调用 search，因此不继承其 Docstore，导入本模块时不需要加载 LangChain。
+    文本在需要时从共享的记录表（records）中按 Index 取出，docstore 编号即 FAISS 编号的字符串形式，配合 PositionIds 使用。
+    修改操作都返回新对象，原对象不变。
+    """
+
+    def __init__(self, issue_ids, field_codes, fields, settings=None, records=None):
+        """
+        :param issue_ids: int64 数组，每个 FAISS 编号对应的问题 Index
+        :param field_codes: int8 数组，每个 FAISS 编号对应的字段在 fields 中的位置
+        :param fields: 字段名列表
+        :param settings: 加载时传给 FAISS 的参数，如 normalize_L2 / distance_strategy
+        :param records: 记录表，提供 get_by_id
+        """
+        self.issue_ids = issue_ids
+        self.field_codes = field_codes
+        self.fields = list(fields)
+        self.settings = settings or {}
+        self.records = records
+
+    @classmethod
+    def from_owners(cls, owners, settings=None, records=None):
+        """由 [(问题 Index, 字段)] 构建"""
+        fields = sorted({field for issue_id, field in owners})
+        codes = {field: i for i, field in enumerate(fields)}
+        return cls(
+            np.array([issue_id for issue_id, field in owners], dtype=np.int64),
+            np.array([codes[field] for issue_id, field in owners], dtype=np.int8),
+            fields, settings, records,
+        )
+
+    def __len__(self):
+        return len(self.issue_ids)
+
+    def owner(self, position):
+        """第 position 个向量对应的 (问题 Index, 字段)"""
+        return int(self.issue_ids[position]), self.fields[self.field_codes[position]]
+
+    def owners(self):
+        """全部向量对应的 (问题 Index, 字段)"""
+        return list(zip(self.issue_ids.tolist(), (self.fields[code] for code in self.field_codes.tolist())))
+
+    def text(self, position):
+        """从记录表取第 position 个向量对应字段的文本，记录已不存在时返回空字符串"""
+        issue_id, field = self.owner(position)
+        record = self.records.get_by_id(issue_id) if self.records is not None else None
+        value = record.get(field) if record is not None else None
+        return (value or {}).get('text') or ""
+
+    def search(self, search):
+        try:
+            position = int(search)
+        except (TypeError, ValueError):
+            return f"ID {search} not found."
+        if not 0 <= position < len(self):
+            return f"ID {search} not found."
+        from langchain_core.documents import Document
+        issue_id, field = self.owner(position)
+        return Document(page_content=self.text(position), metadata={'Index': issue_id, 'Field': field})
+
+    def with_records(self, records):
+        """返回共用编号数组、改从 records 取文本的新 docstore"""
+        return IdDocstore(self.issue_ids, self.field_codes, self.fields, self.settings, records)
+
+    def updated(self, keep, owners=()):
+        """返回只保留 keep 位置的向量、再在末尾追加 owners 的新 docstore"""
+        keep = np.asarray(keep, dtype=np.int64)
+        current = list(zip(self.issue_ids[keep].tolist(), (self.fields[code] for code in self.field_codes[keep].tolist())))
+        return IdDocstore.from_owners(current + list(owners), self.settings, self.records)
+
+    def save(self, path):
+        np.save(os.path.join(path, IDS_FILE), np.asarray(self.issue_ids, dtype=np.int64))
+        np.save(os.path.join(path, FIELDS_FILE), np.asarray(self.field_codes, dtype=np.int8))
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({'version': 2, 'fields': self.fields, 'count': len(self), 'settings': self.settings}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """读取侧文件；mmap=True 时编号数组以只读内存映射方式打开"""
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        return cls(
+            np.load(os.path.join(path, IDS_FILE), mmap_mode=mode),
+            np.load(os.path.join(path, FIELDS_FILE), mmap_mode=mode),
+            meta['fields'], meta.get('settings', {}),
+        )
+
+
+class PositionIds(Mapping):
+    """FAISS 编号到 docstore 编号（编号本身的字符串形式）的映射，不占用与条目数成正比的内存"""
+
+    def __init__(self, count):
+        self.count = count
+
+    def __getitem__(self, faiss_id):
+        if not 0 <= faiss_id < self.count:
+            raise KeyError(faiss_id)
+        return str(faiss_id)
+
+    def __iter__(self):
+        return iter(range(self.count))
+
+    def __len__(self):
+        return self.count
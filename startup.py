@@ -0,0 +1,49 @@
+# startup.py
+import sys
+import subprocess
+
+# 启动时应避免导入的重型模块
+HEAVY_MODULES = ['torch', 'sentence_transformers', 'transformers', 'langchain_huggingface', 'langchain_community']
+
+# 默认统计的模块：应用入口依赖和机器学习相关模块
+REPORT_MODULES = ['utils', 'EC', 'ustai', 'langchain_community.vectorstores', 'langchain_huggingface', 'sentence_transformers', 'torch']
+
+
+def import_time(module):
+    """
+    在独立的子进程中导入模块，用 python -X importtime 统计累计导入耗时（毫秒），
+    并列出导入过程中加载的重型模块；模块不存在时返回 (None, [])
+    """
+    code = (
+        f"import sys, {module}\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, []
+    cumulative = None
+    for line in result.stderr.splitlines():
+        # 格式：import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative = int(parts[1].strip()) / 1000
+    heavy = [m for m in result.stdout.strip().split(",") if m]
+    return cumulative, heavy
+
+
+def import_report(modules=REPORT_MODULES):
+    """
+    导入耗时报告：每个模块一行，包含累计导入耗时和导入时连带加载的重型模块。
+    EC 一行不应出现 torch / sentence_transformers，它们在第一次检索前由后台线程加载
+    """
+    rows = []
+    for module in modules:
+        milliseconds, heavy = import_time(module)
+        rows.append({'module': module, 'import_ms': milliseconds, 'heavy_modules': ', '.join(heavy)})
+    return rows
+
+
+if __name__ == "__main__":
+    for row in import_report():
+        milliseconds = "未安装" if row['import_ms'] is None else f"{row['import_ms']:.0f} ms"
+        print(f"{row['module']:<34} {milliseconds:>10}  {row['heavy_modules']}")
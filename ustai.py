@@ -1,78 +1,390 @@
 
 import base64
-from openai import AzureOpenAI
-from config import api 
-import io
+import time
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from openai.types.chat import ChatCompletion
+from config import api, source_path
+from response_cache import get_response_cache, request_key, DEFAULT_TEMPERATURE
+from image_payload import encode_image, payload_stats
+from ai_metrics import track, usage_metrics, estimate_usage, count_request, acount_request
+
+# 进程内共享的客户端和并发信号量，按配置创建一次，所有会话复用同一个 HTTP 连接池
+_clients = {}
+_semaphores = {}
+# 异步客户端按事件循环分别保存，事件循环结束后自动释放
+_async_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def client_key(config):
+    return tuple(sorted((key, str(value)) for key, value in config.items()))
+
+
+def get_client(config=None):
+    """
+    进程内共享的 AzureOpenAI 客户端：底层 httpx 连接池保持长连接，后续请求不再重新建立 TCP / TLS 连接
+    :param config: 连接配置，默认 config.source_path['ai']
+    """
+    config = config or source_path['ai']
+    key = client_key(config)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = httpx.Client(
+                event_hooks={'request': [count_request]},
+                timeout=httpx.Timeout(config.get('timeout', 60), connect=config.get('connect_timeout', 10)),
+                limits=httpx.Limits(
+                    max_connections=config.get('max_connections', 20),
+                    max_keepalive_connections=config.get('max_keepalive', 10),
+                    keepalive_expiry=config.get('keepalive_expiry', 30),
+                ),
+            )
+            client = _clients[key] = AzureOpenAI(
+                azure_endpoint=config['endpoint'],
+                api_version=config['api_version'],
+                api_key=api['key'],  # put your api key here
+                max_retries=config.get('max_retries', 2),
+                http_client=http_client,
+            )
+            _semaphores[key] = threading.BoundedSemaphore(config.get('max_concurrency', 4))
+    return client
+
+
+def get_semaphore(config=None):
+    """与共享客户端配套的信号量，限制进程内同时进行的模型请求数"""
+    config = config or source_path['ai']
+    get_client(config)
+    return _semaphores[client_key(config)]
+
+
+def get_async_client(config=None):
+    """
+    当前事件循环共享的 AsyncAzureOpenAI 客户端。
+    异步连接池只能在创建它的事件循环中使用，因此每个事件循环各建一个；
+    并发上限不按事件循环划分，与同步调用共用 get_semaphore 的进程内信号量，见 acquire
+    """
+    config = config or source_path['ai']
+    key = client_key(config)
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            http_client = httpx.AsyncClient(
+                event_hooks={'request': [acount_request]},
+                timeout=httpx.Timeout(config.get('timeout', 60), connect=config.get('connect_timeout', 10)),
+                limits=httpx.Limits(
+                    max_connections=config.get('max_connections', 20),
+                    max_keepalive_connections=config.get('max_keepalive', 10),
+                    keepalive_expiry=config.get('keepalive_expiry', 30),
+                ),
+            )
+            client = AsyncAzureOpenAI(
+                azure_endpoint=config['endpoint'],
+                api_version=config['api_version'],
+                api_key=api['key'],
+                max_retries=config.get('max_retries', 2),
+                http_client=http_client,
+            )
+            clients[key] = client
+        return clients[key]
+
+
+async def aclose_clients():
+    """关闭当前事件循环的异步客户端"""
+    with _clients_lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+@asynccontextmanager
+async def acquire(semaphore, poll=0.05):
+    """
+    在异步调用中占用进程内共享的 threading 信号量：有空闲名额时直接获取，
+    否则在线程中等待，不阻塞事件循环。等待中被取消时线程停止等待，已获取的名额立即归还
+    """
+    if not semaphore.acquire(blocking=False):
+        lock = threading.Lock()
+        state = {'cancelled': False, 'owned': False}
+
+        def wait():
+            while True:
+                if semaphore.acquire(timeout=poll):
+                    with lock:
+                        if state['cancelled']:
+                            semaphore.release()
+                        else:
+                            state['owned'] = True
+                    return
+                if state['cancelled']:
+                    return
+
+        try:
+            await asyncio.to_thread(wait)
+        except asyncio.CancelledError:
+            with lock:
+                state['cancelled'] = True
+                if state['owned']:
+                    semaphore.release()
+            raise
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def close_clients():
+    """关闭所有共享客户端及其连接池"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _semaphores.clear()
+
+
 class AI:
-    def __init__(self):
-        self.client = AzureOpenAI(
-        azure_endpoint = "https://hkust.azure-api.net",
-        api_version = "2023-05-15",
-        api_key = api['key'] #put your api key here
-        )
+    def __init__(self, config=None, cache=True, cache_config=None):
+        """
+        :param config: 连接配置，默认 config.source_path['ai']；相同配置的实例共用同一个客户端
+        :param cache: 是否使用持久回答缓存
+        :param cache_config: 回答缓存配置，默认 config.source_path['ai_cache']
+        """
+        self.config = config or source_path['ai']
+        self.client = get_client(self.config)
+        self.semaphore = get_semaphore(self.config)
+        self.cache_config = cache_config or source_path['ai_cache']
+        self.cache = get_response_cache(self.cache_config) if cache else None
+        self.image_stats = None
+
+    def prepare(self, kwargs):
+        """
+        确定性模式下统一 temperature 和 seed；temperature 不超过 cacheable_temperature 的请求计算缓存键
+        :return: (请求参数, 缓存键)，不缓存时缓存键为 None
+        """
+        if self.cache_config.get('deterministic'):
+            kwargs = {**kwargs, 'temperature': 0, 'seed': self.cache_config.get('seed', 0)}
+        if self.cache is None or kwargs.get('temperature', DEFAULT_TEMPERATURE) > self.cache_config.get('cacheable_temperature', 0):
+            return kwargs, None
+        return kwargs, request_key(kwargs)
+
+    def cached(self, key):
+        """缓存中的完整回答，未命中时返回 None"""
+        value = self.cache.get(key) if key else None
+        return ChatCompletion.model_validate_json(value) if value else None
+
+    def store(self, key, response):
+        if key:
+            self.cache.put(key, response.model_dump_json())
+
+    def store_text(self, key, model, text):
+        """流式回答结束后把拼接好的全文按普通回答的格式缓存"""
+        if key:
+            self.store(key, ChatCompletion(
+                id="stream", object="chat.completion", created=int(time.time()), model=model,
+                choices=[{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': text}}],
+            ))
+
+    def stream_kwargs(self):
+        """流式请求的附加参数：配置了 stream_usage 时要求在最后一段返回 token 用量"""
+        return {'stream': True, **({'stream_options': {'include_usage': True}} if self.config.get('stream_usage') else {})}
+
+    def complete(self, **kwargs):
+        """在并发上限内调用 chat.completions.create，相同请求优先使用缓存；调用情况记入 ai_metrics"""
+        kwargs, key = self.prepare(kwargs)
+        with track('complete', kwargs) as call:
+            response = self.cached(key)
+            call['cache_hit'] = response is not None
+            if response is None:
+                wait = time.perf_counter()
+                with self.semaphore:
+                    call['wait_ms'] = (time.perf_counter() - wait) * 1000
+                    response = self.client.chat.completions.create(**kwargs)
+                self.store(key, response)
+                # 缓存命中没有消耗 token，只统计实际请求的用量
+                call.update(usage_metrics(response.usage))
+        return response
+
+    def stream(self, **kwargs):
+        """在并发上限内以流式方式调用 chat.completions.create，逐段返回生成的文本；缓存命中时一次返回全文"""
+        kwargs, key = self.prepare(kwargs)
+        with track('stream', kwargs) as call:
+            response = self.cached(key)
+            call['cache_hit'] = response is not None
+            if response is not None:
+                yield response.choices[0].message.content
+                return
+            parts = []
+            started = False
+            wait = time.perf_counter()
+            try:
+                with self.semaphore:
+                    call['wait_ms'] = (time.perf_counter() - wait) * 1000
+                    for chunk in self.client.chat.completions.create(**kwargs, **self.stream_kwargs()):
+                        started = True
+                        call.update(usage_metrics(getattr(chunk, 'usage', None)))
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if not parts:
+                                call['first_token_ms'] = (time.perf_counter() - wait) * 1000
+                            parts.append(chunk.choices[0].delta.content)
+                            yield parts[-1]
+            finally:
+                # 服务端没有返回用量（未开启 stream_usage 或中途停止读取）时按请求和已收到的文本估算
+                if started and 'total_tokens' not in call:
+                    call.update(estimate_usage(kwargs, "".join(parts)))
+            self.store_text(key, kwargs['model'], "".join(parts))
+
+    async def acomplete(self, **kwargs):
+        """异步版 complete，与同步调用共用进程内的并发上限"""
+        kwargs, key = self.prepare(kwargs)
+        with track('acomplete', kwargs) as call:
+            response = self.cached(key)
+            call['cache_hit'] = response is not None
+            if response is None:
+                client = get_async_client(self.config)
+                wait = time.perf_counter()
+                async with acquire(self.semaphore):
+                    call['wait_ms'] = (time.perf_counter() - wait) * 1000
+                    response = await client.chat.completions.create(**kwargs)
+                self.store(key, response)
+                call.update(usage_metrics(response.usage))
+        return response
+
+    async def astream(self, **kwargs):
+        """异步版 stream"""
+        kwargs, key = self.prepare(kwargs)
+        with track('astream', kwargs) as call:
+            response = self.cached(key)
+            call['cache_hit'] = response is not None
+            if response is not None:
+                yield response.choices[0].message.content
+                return
+            parts = []
+            started = False
+            client = get_async_client(self.config)
+            wait = time.perf_counter()
+            try:
+                async with acquire(self.semaphore):
+                    call['wait_ms'] = (time.perf_counter() - wait) * 1000
+                    async for chunk in await client.chat.completions.create(**kwargs, **self.stream_kwargs()):
+                        started = True
+                        call.update(usage_metrics(getattr(chunk, 'usage', None)))
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if not parts:
+                                call['first_token_ms'] = (time.perf_counter() - wait) * 1000
+                            parts.append(chunk.choices[0].delta.content)
+                            yield parts[-1]
+            finally:
+                if started and 'total_tokens' not in call:
+                    call.update(estimate_usage(kwargs, "".join(parts)))
+            self.store_text(key, kwargs['model'], "".join(parts))
 
     # 读取并编码图像
     def encode_image(self,image_path):
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode("utf-8")
 
+    def image_request(self, images, prompt, detail=None):
+        """
+        图像理解的请求参数：文字提示和预处理后 base64 编码的图片，
+        图片字节统计保存在 self.image_stats
+        :param detail: 图像理解精度 low / high / auto，默认 config.source_path['ai_images']['detail']
+        """
+        # 确保 images 是列表，即使传入单个图像
+        if not isinstance(images, list):
+            images = [images]
+        detail = detail or source_path['ai_images'].get('detail', 'high')
+
+        # 准备多张图片的内容：按精度缩放并重新编码，已符合要求的图片直接使用原文件
+        content = [{"type": "text", "text": prompt}]
+        encoded = [encode_image(image, detail) for image in images]
+        for item in encoded:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{item.mime};base64,{item.data}",
+                    "detail": detail,
+                }
+            })
+        self.image_stats = payload_stats(encoded)
+        print(f"图片 {self.image_stats['images']} 张，原图 {self.image_stats['source_bytes']} 字节，"
+              f"上传 {self.image_stats['payload_bytes']} 字节，节省 {self.image_stats['saved_bytes']} 字节")
+
+        return {
+            'model': "gpt-4o",  # 使用支持图像的模型
+            'messages': [{"role": "user", "content": content}],
+            'max_tokens': 300,
+        }
+
+    def text_request(self, message, instruction):
+        """文本问答的请求参数"""
+        return {
+            'model': 'gpt-4o',
+            'temperature': 1,
+            'messages': [
+                {"role": "system", "content": instruction},
+                {"role": "user", "content": message}
+            ],
+        }
+
     # 图像理解函数
-    def analyze_image(self, images, prompt="请描述这些图片的内容。"):
+    def analyze_image(self, images, prompt="请描述这些图片的内容。", detail=None):
         try:
-            # 确保 images 是列表，即使传入单个图像
-            if not isinstance(images, list):
-                images = [images]
-            
-            # 准备多张图片的内容
-            content = [{"type": "text", "text": prompt}]
-            for image in images:
-                # 确定图像格式，默认为 JPEG
-                image_format = image.format if image.format in ["JPEG", "PNG"] else "JPEG"
-                
-                # 将 PIL Image 对象转换为 base64 编码
-                buffered = io.BytesIO()
-                image.save(buffered, format=image_format)
-                base64_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
-                
-                # 设置 MIME 类型以匹配图像格式
-                mime_type = "image/jpeg" if image_format == "JPEG" else "image/png"
-                
-                # 添加图像到内容
-                content.append({
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mime_type};base64,{base64_image}"
-                    }
-                })
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4o",  # 使用支持图像的模型
-                messages=[
-                    {
-                        "role": "user",
-                        "content": content
-                    }
-                ],
-                max_tokens=300
-            )
+            response = self.complete(**self.image_request(images, prompt, detail))
             return response.choices[0].message.content
         except Exception as e:
             return f"Error: {str(e)}"
 
     def get_response(self,message, instruction):
-        response = self.client.chat.completions.create(
-            model = 'gpt-4o',
-            temperature = 1,
-            messages = [
-                {"role": "system", "content": instruction},
-                {"role": "user", "content": message}
-            ]
-        )
-        
-        # print token usage
-        print(response.usage)
+        # token 用量和耗时记入 ai_metrics，见 ai_metrics.snapshot()
+        response = self.complete(**self.text_request(message, instruction))
         # return the response
         return response.choices[0].message.content
+
+    def stream_image(self, images, prompt="请描述这些图片的内容。", detail=None):
+        """流式版 analyze_image，可直接传给 st.write_stream；出错时输出 Error 信息"""
+        try:
+            yield from self.stream(**self.image_request(images, prompt, detail))
+        except Exception as e:
+            yield f"Error: {str(e)}"
+
+    def stream_response(self, message, instruction):
+        """流式版 get_response，可直接传给 st.write_stream"""
+        yield from self.stream(**self.text_request(message, instruction))
+
+    async def aanalyze_image(self, images, prompt="请描述这些图片的内容。", detail=None):
+        """异步版 analyze_image"""
+        try:
+            response = await self.acomplete(**self.image_request(images, prompt, detail))
+            return response.choices[0].message.content
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    async def aget_response(self, message, instruction):
+        """异步版 get_response"""
+        response = await self.acomplete(**self.text_request(message, instruction))
+        return response.choices[0].message.content
+
+    async def astream_response(self, message, instruction):
+        """异步流式版 get_response"""
+        async for text in self.astream(**self.text_request(message, instruction)):
+            yield text
+
+    def get_responses(self, messages, instruction):
+        """
+        同时提交多个问题，同时进行的请求数不超过 max_concurrency
+        :return: 与 messages 顺序一致的回答列表
+        """
+        async def gather():
+            try:
+                return await asyncio.gather(*(self.aget_response(message, instruction) for message in messages))
+            finally:
+                await aclose_clients()
+        return asyncio.run(gather())
     # 测试
 
     #image_path = "images/starteam-logo.png"  # 替换为你的图像路径
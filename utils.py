@@ -1,10 +1,13 @@
 # utils.py
 import streamlit as st
 import pandas as pd
+import numpy as np
 from config import APP_CONFIG, MESSAGES, LANGUAGES, DATE_FORMAT, source_path
 import os
 import pandas as pd
 import logging
+import threading
+from records import IssueRecords
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -148,87 +151,215 @@ def render_QA_card(data):
                             except:
                                 pass
 
-@st.cache_data
-def load_from_dataset(input_excel=source_path['database'], images_dir=source_path['images']):
+IMAGE_FIELDS = ['Description', 'Factory Suggestion', 'STG Proposal', 'Customer Decision']
+
+def loader_messages():
     """
-    从 CSV 文件加载数据集，合并图片字段，清理冗余。
-    
-    Args:
-        input_excel (str): CSV 文件路径
-        images_dir (str): 图片存储目录
-    
-    Returns:
-        list: 数据集，包含每行数据的字典
+    数据集读取日志使用的文案：优先使用当前会话的语言；
+    在 Streamlit 脚本之外（如命令行或定时任务中的数据集更新）没有设置语言时使用英文
     """
+    return MESSAGES[st.session_state.get("language", "en")]
+
+def dataset_store_path(path):
+    """
+    数据集的列式存储路径：与 CSV 同名的 .parquet 文件
+    :param path: CSV 或 Parquet 文件路径
+    :return: Parquet 文件路径
+    """
+    return os.path.splitext(str(path))[0] + '.parquet'
+
+def read_dataset_frame(input_excel):
+    """
+    读取数据集 DataFrame，优先读取列式 Parquet 存储，不存在时回退到旧的 CSV 文件
+    :param input_excel: 数据集路径（CSV 或 Parquet）
+    :return: DataFrame，*_Images 列为图片文件名列表
+    """
+    parquet_path = dataset_store_path(input_excel)
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path)
+
     if not os.path.exists(input_excel):
-        error_msg = MESSAGES[st.session_state.language]["csvFileNotFound"].format(file=input_excel)
+        error_msg = loader_messages()["csvFileNotFound"].format(file=input_excel)
         logger.error(error_msg)
         raise FileNotFoundError(error_msg)
 
     try:
         df = pd.read_csv(input_excel, encoding='utf-8', low_memory=False)
     except UnicodeDecodeError:
-        warning_msg = MESSAGES[st.session_state.language]["csvUtf8Warning"].format(file=input_excel)
+        warning_msg = loader_messages()["csvUtf8Warning"].format(file=input_excel)
         logger.warning(warning_msg)
         df = pd.read_csv(input_excel, encoding='latin1', low_memory=False)
     except Exception as e:
-        error_msg = MESSAGES[st.session_state.language]["csvReadError"].format(file=input_excel, error=str(e))
+        error_msg = loader_messages()["csvReadError"].format(file=input_excel, error=str(e))
         logger.error(error_msg)
         raise ValueError(error_msg)
 
+    for col in df.columns:
+        if col.endswith('_Images'):
+            df[col] = df[col].map(lambda v: [img.strip() for img in v.split(';') if img.strip()] if isinstance(v, str) else [])
+    return df
+
+def write_dataset_frame(df, output_path):
+    """
+    以带类型的列式格式原子写入数据集：Index 为整数，Previous Case 为布尔值，
+    *_Images 为字符串列表，其余列统一为可空字符串
+    :param df: 数据集 DataFrame
+    :param output_path: 数据集路径（CSV 或 Parquet），实际写入同名 .parquet 文件
+    """
+    df = df.copy()
+    for col in df.columns:
+        if col == 'Index':
+            df[col] = df[col].astype('int64')
+        elif col == 'Previous Case':
+            df[col] = df[col].astype(bool)
+        elif col.endswith('_Images'):
+            df[col] = df[col].map(list)
+        else:
+            df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v))
+    parquet_path = dataset_store_path(output_path)
+    tmp_path = f"{parquet_path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, parquet_path)
+
+def export_dataset_csv(df, output_excel):
+    """
+    将数据集导出为 CSV，图片列表以分号连接
+    :param df: 数据集 DataFrame
+    :param output_excel: CSV 文件路径
+    """
+    df = df.copy()
+    for col in df.columns:
+        if col.endswith('_Images'):
+            df[col] = df[col].map(';'.join)
+    df.to_csv(output_excel, index=False)
+
+@st.cache_data
+def load_from_dataset(input_excel=source_path['database'], images_dir=source_path['images']):
+    """
+    从数据集文件（Parquet 优先，兼容 CSV）加载数据集，合并图片字段，清理冗余。
+    每次调用返回缓存的独立副本，多个会话共享时请使用 load_record_store。
+    
+    Args:
+        input_excel (str): 数据集路径
+        images_dir (str): 图片存储目录
+    
+    Returns:
+        IssueRecords: 数据集，按需还原为每行数据的字典
+    """
+    return read_records(input_excel, images_dir)
+
+_record_store_signatures = {}
+_record_store_lock = threading.Lock()
+
+def dataset_signature(input_excel):
+    """数据集文件（Parquet 和 CSV）的 (修改时间, 大小)，文件不存在时对应位置为 None"""
+    signature = []
+    for path in (dataset_store_path(input_excel), str(input_excel)):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+@st.cache_resource
+def cached_record_store(input_excel, images_dir):
+    """
+    按 (数据集路径, 图片目录) 缓存的记录存储。
+    st.cache_resource 按实际传入的参数生成缓存键，不会补全默认值，请通过 load_record_store 调用
+    """
+    return read_records(input_excel, images_dir)
+
+def load_record_store(input_excel=source_path['database'], images_dir=source_path['images']):
+    """
+    进程内共享的只读问题记录存储：所有会话的 st.session_state['data'] 和 Engine 引用同一个实例，
+    不再各自保存一份数据副本。数据集更新后需调用 clear_record_store()。
+    路径统一转换为字符串后按位置传给缓存函数，无论调用方是否传参、传 str 还是 Path，都命中同一个缓存条目。
+    每次调用检查数据集文件的修改时间和大小，文件变化（如导入新的 EQ）后清除缓存重新读取，不需要加载 Engine。
+    
+    Args:
+        input_excel (str): 数据集路径
+        images_dir (str): 图片存储目录
+    
+    Returns:
+        IssueRecords: 共享的只读数据集
+    """
+    key = (str(input_excel), str(images_dir))
+    signature = dataset_signature(input_excel)
+    with _record_store_lock:
+        if _record_store_signatures.get(key, signature) != signature:
+            clear_record_store()
+        _record_store_signatures[key] = signature
+    return cached_record_store(*key)
+
+def clear_record_store():
+    """清除共享记录存储的缓存，下次 load_record_store 时重新读取数据集"""
+    cached_record_store.clear()
+
+def read_records(input_excel, images_dir):
+    """
+    读取数据集并整理为按列存储的 IssueRecords，供 load_from_dataset 和 load_record_store 使用
+    
+    Args:
+        input_excel (str): 数据集路径
+        images_dir (str): 图片存储目录
+    
+    Returns:
+        IssueRecords: 数据集
+    """
+    df = read_dataset_frame(input_excel)
+
     if df.empty:
-        warning_msg = MESSAGES[st.session_state.language]["csvEmptyWarning"].format(file=input_excel)
+        warning_msg = loader_messages()["csvEmptyWarning"].format(file=input_excel)
         logger.warning(warning_msg)
         return []
 
-    columns = df.columns.tolist()
-    dataset = []
-    image_fields = ['Description', 'Factory Suggestion', 'STG Proposal', 'Customer Decision']
+    df = df.reset_index(drop=True)
+    length = len(df)
     image_files = set(os.listdir(images_dir))
     missing_images = set()
 
-    for idx, row in df.iterrows():
-        try:
-            issue = {}
-            for col in columns:
-                if pd.isna(row.get(col)):
-                    if col in image_fields:
-                        issue[col] = issue.get(col, {'text': None, 'image': []})
-                    else:
-                        issue[col] = None
-                    continue
-
-                if col.endswith('_Images'):
-                    field_name = col.replace('_Images', '')
-                    images = str(row[col]).split(';') if isinstance(row[col], str) else []
-                    valid_images = set(img.strip() for img in images if img.strip() and img.strip() in image_files)
-                    for img in images:
-                        if img.strip() and img.strip() not in image_files:
-                            missing_images.add((idx + 2, img.strip()))
-                    issue[field_name] = issue.get(field_name, {'text': None, 'image': []})
-                    issue[field_name]['image'].extend(valid_images)
-                elif col in image_fields:
-                    issue[col] = issue.get(col, {'text': None, 'image': []})
-                    issue[col]['text'] = row[col]
-                else:
-                    issue[col] = row[col]
-
-            issue = {k: v for k, v in issue.items() if not (v is None or (isinstance(v, dict) and v.get('text') is None and not v.get('image')))}
-            dataset.append(issue)
-        except Exception as e:
-            warning_msg = MESSAGES[st.session_state.language]["rowProcessingError"].format(row=idx + 2, error=str(e))
-            logger.warning(warning_msg)
-            continue
+    # 按原字典的键顺序整理字段：*_Images 列和 IMAGE_FIELDS 文本列合并为 {'text', 'image'} 结构
+    texts = {}
+    images = {}
+    keys = []
+    for col in df.columns:
+        if col.endswith('_Images'):
+            key = col.replace('_Images', '')
+            exploded = df[col].explode()
+            exploded = exploded[exploded.notna()]
+            valid = exploded.isin(image_files)
+            for row, img in exploded[~valid].items():
+                missing_images.add((row + 2, img))
+            kept = exploded[valid]
+            kept = kept[~pd.MultiIndex.from_arrays([kept.index, kept.values]).duplicated()]
+            # explode 保持行顺序，记录每行在扁平数组中的起止位置，访问时再切片
+            rows = kept.index.to_numpy()
+            offsets = np.searchsorted(rows, np.arange(length + 1))
+            images[key] = (kept.to_numpy(dtype=object), offsets)
+        else:
+            key = col
+            texts[key] = df[col].astype(object).where(df[col].notna(), None).to_numpy()
+        if key not in keys:
+            keys.append(key)
+
+    fields = []
+    for key in keys:
+        if key in IMAGE_FIELDS or key in images:
+            fields.append((key, True, texts.get(key), images.get(key)))
+        else:
+            fields.append((key, False, texts[key], None))
+    dataset = IssueRecords(fields, length)
 
     for row_num, img in missing_images:
-        warning_msg = MESSAGES[st.session_state.language]["imageNotFoundWarning"].format(row=row_num, image=img, dir=images_dir)
+        warning_msg = loader_messages()["imageNotFoundWarning"].format(row=row_num, image=img, dir=images_dir)
         logger.warning(warning_msg)
 
     if not dataset:
-        warning_msg = MESSAGES[st.session_state.language]["csvNoDataWarning"].format(file=input_excel)
+        warning_msg = loader_messages()["csvNoDataWarning"].format(file=input_excel)
         logger.warning(warning_msg)
     
-    success_msg = MESSAGES[st.session_state.language]["csvLoadSuccess"].format(file=input_excel, count=len(dataset))
+    success_msg = loader_messages()["csvLoadSuccess"].format(file=input_excel, count=len(dataset))
     logger.info(success_msg)
     return dataset
 
@@ -0,0 +1,209 @@
+# vector_index.py
+import math
+import time
+import numpy as np
+import faiss
+
+# 支持的索引类型：精确检索 flat，近似检索 ivf_flat / ivf_pq / hnsw，以及标量量化存储 sq8（int8）/ sq_fp16（float16）
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq8', 'sq_fp16')
+
+# 标量量化的编码方式
+SCALAR_QUANTIZERS = {'sq8': faiss.ScalarQuantizer.QT_8bit, 'sq_fp16': faiss.ScalarQuantizer.QT_fp16}
+
+# recall_report 默认比较的索引配置
+REPORT_CONFIGS = [
+    {'type': 'ivf_flat', 'nprobe': 1},
+    {'type': 'ivf_flat', 'nprobe': 8},
+    {'type': 'ivf_flat', 'nprobe': 32},
+    {'type': 'ivf_pq', 'nprobe': 8},
+    {'type': 'ivf_pq', 'nprobe': 32},
+    {'type': 'hnsw', 'efSearch': 16},
+    {'type': 'hnsw', 'efSearch': 64},
+    {'type': 'hnsw', 'efSearch': 128},
+    {'type': 'sq_fp16'},
+    {'type': 'sq8'},
+    {'type': 'sq8', 'rerank': 4},
+    {'type': 'ivf_pq', 'nprobe': 32, 'rerank': 4},
+]
+
+
+def build_index(vectors, config, metric=faiss.METRIC_L2):
+    """
+    按配置构建 FAISS 索引，需要训练的索引直接用已有向量训练
+    :param vectors: float32 向量矩阵 (n, dim)
+    :param config: 索引配置，见 config.source_path['index']
+    :param metric: 距离度量，与原精确索引保持一致
+    :return: 已添加全部向量的索引，向量编号与 vectors 的行号一致
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index_type = config.get('type', 'flat')
+
+    if index_type == 'flat':
+        index = faiss.IndexFlat(dim, metric)
+    elif index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = min(config.get('nlist') or max(1, int(4 * math.sqrt(n))), n)
+        quantizer = faiss.IndexFlat(dim, metric)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            m = config.get('pq_m', 16)
+            if dim % m:
+                raise ValueError(f"向量维度 {dim} 不能被 PQ 子空间数 {m} 整除")
+            # 每个子空间的码本大小不能超过训练样本数
+            nbits = min(config.get('pq_nbits', 8), max(1, int(math.log2(n))))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits, metric)
+        index.train(vectors)
+        index.nprobe = config.get('nprobe', 8)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, config.get('hnsw_m', 32), metric)
+        index.hnsw.efConstruction = config.get('efConstruction', 40)
+        index.hnsw.efSearch = config.get('efSearch', 64)
+    elif index_type in SCALAR_QUANTIZERS:
+        index = faiss.IndexScalarQuantizer(dim, SCALAR_QUANTIZERS[index_type], metric)
+        index.train(vectors)
+    else:
+        raise ValueError(f"未知的索引类型 {index_type}，可选 {', '.join(INDEX_TYPES)}")
+
+    index.add(vectors)
+    return index
+
+
+def search_params(index, config, selector=None):
+    """
+    生成检索参数：IVF 索引使用 nprobe，HNSW 索引使用 efSearch，可附带 ID 选择器
+    :return: faiss SearchParameters，无需任何参数时返回 None
+    """
+    kwargs = {} if selector is None else {'sel': selector}
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=config.get('nprobe', index.nprobe), **kwargs)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=config.get('efSearch', index.hnsw.efSearch), **kwargs)
+    return faiss.SearchParameters(**kwargs) if kwargs else None
+
+
+def remove_vectors(index, remove_ids):
+    """
+    返回删除指定编号后的新索引，其余向量按原顺序重新编号为 0..n-1，原索引不变。
+    flat 索引直接 remove_ids；IVF / HNSW 的 remove_ids 不会压缩编号或不受支持，
+    因此还原保留的向量后在保留训练结果的副本上重新添加。
+    """
+    index = faiss.clone_index(index)
+    remove_ids = np.asarray(remove_ids, dtype=np.int64)
+    if isinstance(index, faiss.IndexFlat):
+        index.remove_ids(faiss.IDSelectorBatch(remove_ids))
+        return index
+    keep = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), remove_ids)
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    vectors = index.reconstruct_batch(keep)
+    index.reset()
+    index.add(vectors)
+    return index
+
+
+def append_vectors(index, vectors):
+    """返回追加向量后的新索引，新向量编号接在现有编号之后，原索引不变"""
+    index = faiss.clone_index(index)
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return index
+
+
+def exact_rerank(queries, ids, lookup, k, metric=faiss.METRIC_L2):
+    """
+    用原始 float32 向量对近似检索的候选重新计算精确距离并排序
+    :param queries: 查询向量 (q, dim)
+    :param ids: 候选编号矩阵 (q, m)，-1 表示空位
+    :param lookup: 由编号数组取原始向量的函数
+    :return: (距离矩阵, 编号矩阵)，形状 (q, k)，不足 k 个时以 -1 补齐
+    """
+    scores = np.full((len(queries), k), np.inf if metric == faiss.METRIC_L2 else -np.inf, dtype=np.float32)
+    found = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, (query, candidates) in enumerate(zip(queries, ids)):
+        candidates = candidates[candidates >= 0]
+        if not len(candidates):
+            continue
+        vectors = np.asarray(lookup(candidates), dtype=np.float32)
+        if metric == faiss.METRIC_L2:
+            distances = ((vectors - query) ** 2).sum(axis=1)
+            order = np.argsort(distances, kind='stable')[:k]
+        else:
+            distances = vectors @ query
+            order = np.argsort(-distances, kind='stable')[:k]
+        scores[row, :len(order)] = distances[order]
+        found[row, :len(order)] = candidates[order]
+    return scores, found
+
+
+def index_bytes(index):
+    """索引序列化后的字节数，近似为加载后占用的内存"""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def describe(config):
+    """索引配置的简短描述，用于报告"""
+    index_type = config.get('type', 'flat')
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        text = f"{index_type} nprobe={config.get('nprobe', 8)}"
+    elif index_type == 'hnsw':
+        text = f"hnsw efSearch={config.get('efSearch', 64)}"
+    else:
+        text = index_type
+    if config.get('rerank'):
+        text += f" rerank={config['rerank']}"
+    return text
+
+
+def timed_search(index, queries, k, params=None):
+    """逐条查询并计时，返回 (结果编号矩阵, 平均单条延迟毫秒)"""
+    start = time.perf_counter()
+    found = np.vstack([index.search(query[None, :], k, params=params)[1] for query in queries])
+    return found, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall_report(vectors, queries, k=10, configs=REPORT_CONFIGS, metric=faiss.METRIC_L2):
+    """
+    以精确 flat 索引为基准，比较各索引配置的 recall@k 和单条查询延迟
+    :param vectors: 数据集向量 (n, dim)
+    :param queries: 查询向量 (q, dim)
+    :param k: 每条查询返回的结果数
+    :param configs: 待比较的索引配置列表，相同构建参数的索引只构建一次；
+        rerank=r 表示先取 k * r 个候选，再用原始向量精确重排
+    :return: 每个配置一行的字典列表，bytes 为索引占用的字节数
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, len(vectors))
+
+    exact = build_index(vectors, {'type': 'flat'}, metric)
+    truth, exact_latency = timed_search(exact, queries, k)
+
+    rows = [{'index': 'flat', 'recall@k': 1.0, 'latency_ms': exact_latency, 'build_s': 0.0, 'ntotal': exact.ntotal, 'bytes': index_bytes(exact)}]
+    built = {}
+    for config in configs:
+        # nprobe / efSearch 只影响检索，不需要重新构建
+        build_key = tuple(sorted((key, str(value)) for key, value in config.items() if key not in ('nprobe', 'efSearch', 'rerank')))
+        if build_key not in built:
+            start = time.perf_counter()
+            index = build_index(vectors, config, metric)
+            built[build_key] = (index, time.perf_counter() - start)
+        index, build_seconds = built[build_key]
+
+        rerank = config.get('rerank') or 0
+        if rerank > 1:
+            start = time.perf_counter()
+            candidates = timed_search(index, queries, min(k * rerank, len(vectors)), search_params(index, config))[0]
+            found = exact_rerank(queries, candidates, lambda ids: vectors[ids], k, metric)[1]
+            latency = (time.perf_counter() - start) * 1000 / len(queries)
+        else:
+            found, latency = timed_search(index, queries, k, search_params(index, config))
+        hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+        rows.append({
+            'index': describe(config),
+            'recall@k': hits / (len(queries) * k),
+            'latency_ms': latency,
+            'build_s': build_seconds,
+            'ntotal': index.ntotal,
+            'bytes': index_bytes(index),
+        })
+    return rows